@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# benchmark.py - Timing of the CraftyTutor on synthetic data             #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import time
+import json
+import random
+import argparse
+import builtins
+import platform
+import tempfile
+import statistics
+import contextlib
+import xml.etree.ElementTree as ET
+
+import craftytutor
+import stringcompleter.stringcompleter as stringcompleter
+
+
+########################################################################
+# Synthetic data                                                       #
+########################################################################
+
+def make_sheets(n_sheets, n_probs):
+    """Create the xml tree of n_sheets sheets with n_probs problems each."""
+    root = ET.Element('data')
+    probno = 0
+    for sheetno in range(1, n_sheets + 1):
+        xsheet = ET.SubElement(root, 'sheet', {'no': str(sheetno)})
+        for i in range(n_probs):
+            probno += 1
+            xprob = ET.SubElement(xsheet, 'prob', {'no': str(probno),
+                                  'type': 'w' if i % 2 else 'v'})
+            xprob.text = str(4 + i % 3)
+    return root
+
+
+def make_group(n_students, sheets, seed=0):
+    """Create the xml tree of a group with random scores for all sheets.
+
+    Names contain single and double quotes.
+    """
+    rand = random.Random(seed)
+    root = ET.Element('data')
+    ET.SubElement(root, 'title').text = "Benchmark"
+    ET.SubElement(root, 'subtitle').text = "Sheet "
+    for i in range(n_students):
+        xstud = ET.SubElement(root, 'student')
+        ET.SubElement(xstud, 'name').text = student_name(i)
+        ET.SubElement(xstud, 'board').text = str(rand.randrange(4))
+        ET.SubElement(xstud, 'id').text = str(100000 + i)
+        for xsheet in sheets.findall('sheet'):
+            xstudsheet = ET.SubElement(xstud, 'sheet',
+                                       {'no': xsheet.attrib['no']})
+            for xprob in xsheet.findall('prob'):
+                score = rand.randrange(2 * int(xprob.text) + 1) / 2
+                ET.SubElement(xstudsheet, 'prob',
+                              {'no': xprob.attrib['no']}).text = \
+                    "{:g}".format(score)
+    return root
+
+
+def student_name(i):
+    """Return a distinct student name, some with quotes."""
+    if i % 3 == 0:
+        return "O'Neil {}".format(i)
+    if i % 3 == 1:
+        return 'Max "Mad" Muster{}'.format(i)
+    return "D'Arcy \"Doc\" {}".format(i)
+
+
+########################################################################
+# Timing                                                               #
+########################################################################
+
+def timeit(func, repeat, restore=None):
+    """Run func repeat times and return the durations in seconds.
+
+    restore is called untimed after each run to undo its changes.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if restore is not None:
+            restore()
+    return times
+
+
+def run(args):
+    """Generate the data, time the key paths and return the results."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sheetsfile = os.path.join(tmpdir, 'sheets.xml')
+        groupfile = os.path.join(tmpdir, 'group.xml')
+        sheets = make_sheets(args.sheets, args.probs)
+        craftytutor.write_xml(sheets, sheetsfile)
+        craftytutor.write_xml(make_group(args.students, sheets), groupfile)
+
+        # answer all prompts with their default
+        builtins.input = lambda prompt='': ''
+        ct = craftytutor.CraftyTutor(sheetsfile, groupfile)
+        sheet = str(args.sheets)
+
+        def points_of_all_studs():
+            for stud in ct.group.students:
+                ct.get_points_of_stud(stud)
+
+        def complete():
+            completer = stringcompleter.StringCompleter(ct.names)
+            for prefix in ("O'", 'Max "', "D'Arcy \"Doc\" 1", "Z"):
+                state = 0
+                while completer.complete(prefix, state) is not None:
+                    state += 1
+
+        def fuzzy_search():
+            for typo in ("ONeil 12", 'Max Mad Mustr7', "DArcy Doc 5", "10012"):
+                ct.name_index.search(typo, 5)
+
+        def print_table():
+            # time the rendering, not the check against the manifest
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(tmpdir, 'group.manifest'))
+            ct.print_table(sheet)
+
+        table = ct.get_table(ct.sheets[sheet], {
+            'id': True, 'percent': True,
+            'current_written': True, 'current_vote': False})
+
+        def render_tables():
+            for style in craftytutor.TABLE_STYLES.values():
+                craftytutor.render_table(style, table)
+
+        def write():
+            # force rewriting both files
+            ct.mutate('titles', "Benchmark", "Sheet ")
+            ct.mutate('sheet', str(args.sheets + 1), [])
+            ct.do_write(None)
+
+        def unwrite():
+            # every run writes the same data
+            ct.do_undo('2')
+            ct.do_write(None)
+
+        cases = [
+            ('do_reload', lambda: ct.do_reload(None)),
+            ('update_names', ct.update_names),
+            ('get_points_of_stud', points_of_all_studs),
+            ('print_table', print_table),
+            ('render_table', render_tables),
+            ('print_ranking', lambda: ct.print_ranking(10)),
+            ('do_write', write, unwrite),
+            ('StringCompleter.complete', complete),
+            ('TrigramIndex.search', fuzzy_search),
+        ]
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            for name, func, *restore in cases:
+                if args.only and name not in args.only:
+                    continue
+                times = timeit(func, args.repeat, *restore)
+                results[name] = {
+                    'min': min(times),
+                    'median': statistics.median(times),
+                    'runs': len(times),
+                }
+                print("{:<26} min {:9.4f} s   median {:9.4f} s".format(
+                    name, results[name]['min'], results[name]['median']),
+                    file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare(results, oldfile):
+    """Print the ratio of the medians to those of an earlier run."""
+    with open(oldfile) as fold:
+        old = json.load(fold)['results']
+    for name, result in results.items():
+        if name in old and old[name]['median']:
+            print("{:<26} {:6.2f}x".format(
+                name, result['median'] / old[name]['median']),
+                file=sys.stderr)
+
+
+def main():
+    # parse command line arguments
+    parser = argparse.ArgumentParser(
+            description="Time the CraftyTutor on synthetic data")
+    parser.add_argument('--sheets', type=int, default=20,
+            help="number of sheets (default: %(default)s)")
+    parser.add_argument('--probs', type=int, default=8,
+            help="problems per sheet (default: %(default)s)")
+    parser.add_argument('--students', type=int, default=5000,
+            help="number of students (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+            help="runs per case (default: %(default)s)")
+    parser.add_argument('--only', action='append',
+            help="only run the given case, may be repeated")
+    parser.add_argument('--output', help="write the results as JSON to file")
+    parser.add_argument('--compare', metavar='FILE',
+            help="compare with the JSON results of an earlier run")
+    args = parser.parse_args()
+
+    # keep stdout free for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    report = {
+        'params': {'sheets': args.sheets, 'probs': args.probs,
+                   'students': args.students, 'repeat': args.repeat},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
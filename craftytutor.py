@@ -22,11 +22,35 @@ import shutil
 import readline
 import cmd
 import argparse
+import csv
 import os.path
+import marshal
+import gc
+import json
+import array
+import itertools
+import math
+import time
+import collections
+import tracemalloc
+import cProfile
+import pstats
+import configparser
+import concurrent.futures
+import contextlib
+import io
+import hashlib
+import threading
+import signal
 import operator
+import heapq
+import sqlite3
 import xml.etree.ElementTree as ET
 
 import stringcompleter.stringcompleter as stringcompleter
+import sqlitestore.sqlitestore as sqlitestore
+import tutordaemon.tutordaemon as tutordaemon
+import tutormodel.tutormodel as tutormodel
 
 
 class CraftyTutor(cmd.Cmd):
@@ -42,46 +66,164 @@ class CraftyTutor(cmd.Cmd):
         """Don't do anything if command is empty."""
         pass
 
-    def __init__(self, sheets, group):
+    def __init__(self, sheets, group, journal=False, database=None,
+                 timing=False, answers=None, batch=False, shared_sheets=None,
+                 lazy=False, autosave=0, daemon=None):
         """Initialize the CraftyTutor
 
         @sheets: filename of the XML file of the sheets
         @group: filename of the XML file of the group
+        @journal: save changes by appending them to journal files instead
+                  of rewriting the XML files
+        @database: filename of a SQLite database to store sheets and group
+                   in instead of the XML files
+        @timing: record wall time, CPU time and peak memory allocation of
+                 every command, see 'stats'
+        @answers: dict of answers to prompts by key, see prompt_value
+        @batch: never prompt, use answers or defaults instead
+        @shared_sheets: already loaded list of sheets to use instead of
+                        reading and backing up the sheets file
+        @lazy: read the scores of the group file only when they are
+               needed, see load_scores
+        @autosave: seconds after a change to save unsaved changes to the
+                   recovery file in the background, 0 for never
+        @daemon: path of the Unix socket of a daemon holding sheets and
+                 group to use instead of the XML files, see TutorDaemon
         """
         cmd.Cmd.__init__(self)
         self.sheetsfile = sheets
         self.groupfile = group
+        self.journal = journal
+        self.store = None
+        self.daemon = None
+        self.timing = timing
+        self.cmd_stats = {}
+        self.answers = answers or {}
+        self.batch = batch
+        self.shared_sheets = shared_sheets
+        self.lazy = lazy and not database and not daemon
+        # 'lock' guards 'pending', 'autosave_lock' the recovery file
+        self.pending = []
+        self.name_index = stringcompleter.TrigramIndex()
+        self.undo_stack = []
+        self.redo_stack = []
+        self.lock = threading.RLock()
+        self.autosave_lock = threading.Lock()
+        self.autosave_cond = threading.Condition(self.lock)
+        self.autosave_changes = 0
+        self.autosave_stop = False
+        self.save_count = 0
+        if daemon:
+            newsheet = self.init_daemon(daemon)
+        elif database:
+            newsheet = self.init_store(database)
+        else:
+            newsheet = self.init_files()
+        # parse the files 
+        autosaved = None if daemon else self.read_autosave()
+        self.do_reload(None)
+        if autosaved:
+            self.recover_autosave(autosaved)
+        # the daemon saves the changes of its clients
+        if autosave and not daemon:
+            threading.Thread(target=self.autosave_loop, args=(autosave,),
+                             daemon=True).start()
+        if newsheet:
+            self.settitles()
+            print("Use 'addstudents' to fill.\n")
+        else:
+            problems = self.check()
+            if problems:
+                print("Found {} problems in the data, see 'check'.\n"
+                      .format(len(problems)))
+
+    def init_files(self):
+        """Backup existing XML files and initialize missing ones.
+
+        Return whether the group is new.
+        """
+        sheets = self.sheetsfile
+        group = self.groupfile
         # backup if file exists else initialize new files
-        if os.path.exists(sheets):
-            shutil.copyfile(sheets, sheets + ".old")
+        if self.shared_sheets is not None:
+            pass
+        elif os.path.exists(sheets):
+            backup(sheets)
         else:
             print("Creating new sheets file, use newsheet <arg> to fill.\n")
             self.init_xml(sheets)
         newsheet = False
         if os.path.exists(group):
-            shutil.copyfile(group, group + ".old")
+            backup(group)
         else:
             print("Creating new group file...")
             self.init_xml(group)
             newsheet = True
-        # parse the files 
-        self.do_reload(None)
-        if newsheet:
-            self.settitles()
-            print("Use 'addstudents' to fill.\n")
+        return newsheet
+
+    def init_store(self, database):
+        """Open the database and import sheets or group missing in it from
+        the XML files.
+
+        Return whether the group is new.
+        """
+        self.store = sqlitestore.SQLiteStore(database)
+        self.groupname = os.path.basename(self.groupfile).replace(".xml", "")
+        if not self.store.has_sheets() and os.path.exists(self.sheetsfile):
+            print("Importing {} into the database.".format(self.sheetsfile))
+            try:
+                self.store.import_sheets(parse_xml(self.sheetsfile).getroot())
+            except sqlite3.IntegrityError as e:
+                # the database has no room for duplicate numbers
+                raise ValueError("cannot import {}: {}".format(
+                    self.sheetsfile, e)) from None
+        if self.store.has_group(self.groupname):
+            return False
+        if os.path.exists(self.groupfile):
+            print("Importing {} into the database.".format(self.groupfile))
+            self.store.import_group(self.groupname,
+                                    parse_xml(self.groupfile).getroot())
+            return False
+        print("Creating new group...")
+        return True
+
+    def init_daemon(self, path):
+        """Connect to the daemon serving the group.
+
+        Return whether the group is new, which is never the case as the
+        daemon created it.
+        """
+        self.daemon = tutordaemon.DaemonClient(path)
+        hello = self.daemon.request('hello')
+        if hello['sheets'] != os.path.abspath(self.sheetsfile):
+            raise ValueError("the daemon serves the sheets {}".format(
+                hello['sheets']))
+        if os.path.abspath(self.groupfile) not in hello['groups']:
+            raise ValueError("the daemon does not serve the group {}".format(
+                self.groupfile))
+        return False
 
     def precmd(self, line):
         """Unset command autocompletion inside the commands."""
+        # show the changes of other tutors before running the command
+        if self.daemon is not None:
+            self.sync()
         self.oldcompleter = readline.get_completer()
         self.oldcompleterdelims = readline.get_completer_delims()
         readline.set_completer_delims('')
         self.set_empty_completion()
+        # start measuring the command
+        if self.timing:
+            tracemalloc.start()
+            self.cmd_start = (time.perf_counter(), time.process_time())
         return line
 
     def postcmd(self, stop, line):
         """Reset command autocompletion before returning."""
         readline.set_completer(self.oldcompleter)
         readline.set_completer_delims(self.oldcompleterdelims)
+        if self.timing:
+            self.record_timing(line)
         return stop
 
     ####################################################################
@@ -91,7 +233,6 @@ class CraftyTutor(cmd.Cmd):
     def do_addstudents(self, arg):
         "Add students to the current group."
         self.addstudents()
-        self.update_names()
 
     def do_addids(self, arg):
         "Add/change the student ids (Matrikelnummer)."
@@ -105,73 +246,1065 @@ class CraftyTutor(cmd.Cmd):
         "Enter score of the sheet <arg>."
         self.ratesheet(arg)
 
+    def do_importscores(self, arg):
+        "Import scores of sheet <arg1> from CSV/TSV file <arg2>."
+        args = arg.split(None, 1)
+        if len(args) != 2:
+            print("Usage: importscores <sheet> <file>")
+            return
+        self.importscores(*args)
+
     def do_presented(self, arg):
         "Enter persons which presented problem of sheet <arg>."
         self.presented(arg)
 
+    def do_undo(self, arg):
+        "Undo the last change, or the last <arg> changes."
+        for i in range(int(arg) if arg.isdigit() else 1):
+            if not self.undo_stack:
+                print("Nothing to undo.")
+                break
+            record = self.undo()
+            if record is None:
+                break
+            print("Undone: {}".format(describe_record(record)))
+
+    def do_redo(self, arg):
+        "Redo the last undone change, or the last <arg> undone changes."
+        for i in range(int(arg) if arg.isdigit() else 1):
+            if not self.redo_stack:
+                print("Nothing to redo.")
+                break
+            record = self.redo()
+            if record is None:
+                break
+            print("Redone: {}".format(describe_record(record)))
+
     def do_write(self, arg):
         "Write changes to file."
-        indent(self.root_group)
-        self.tree_group.write(self.groupfile, encoding='unicode',
-                xml_declaration=True)
-        indent(self.root_sheets)
-        self.tree_sheets.write(self.sheetsfile, encoding='unicode',
-                xml_declaration=True)
+        if self.daemon is not None:
+            saved = self.daemon.request('write')['saved']
+            print("Saved {} changes of all tutors.".format(saved))
+            self.clear_pending()
+            return
+        if self.store is not None:
+            try:
+                self.store.apply(self.groupname, self.pending)
+            except sqlite3.Error as e:
+                print("Cannot save the changes to the database: {}\n"
+                      "Undo the failing change or 'reload' to discard "
+                      "the unsaved changes.".format(e))
+                return
+            self.clear_pending()
+            return
+        if not self.journal:
+            self.do_compact(arg)
+            return
+        # append changes to the journals, compact them if too large
+        for xmlfile, records in self.pending_by_file():
+            if records:
+                append_journal(xmlfile, records)
+            if journal_size(xmlfile) > JOURNAL_COMPACT_SIZE:
+                self.save_xml(xmlfile)
+        self.clear_pending()
+
+    def do_compact(self, arg):
+        "Write all changes including the journals into the XML files."
+        if self.store is not None or self.daemon is not None:
+            self.do_write(arg)
+            return
+        # files without changes are not rewritten
+        for xmlfile, records in self.pending_by_file():
+            if records or journal_size(xmlfile):
+                self.save_xml(xmlfile)
+        self.clear_pending()
 
     def do_reload(self, arg):
         "Reload files (discard unsaved changes)"
-        self.tree_sheets = ET.parse(self.sheetsfile)
-        self.tree_group = ET.parse(self.groupfile)
-        self.root_sheets = self.tree_sheets.getroot()
-        self.root_group = self.tree_group.getroot()
+        if self.daemon is not None:
+            # the changes are kept by the daemon
+            snapshot = self.daemon.request(
+                    'open', group=os.path.abspath(self.groupfile))
+            self.sheet_list = tutormodel.unflatten_sheets(snapshot['sheets'])
+            self.group = tutormodel.unflatten_group(snapshot['group'])
+        elif self.store is not None:
+            with gc_paused():
+                self.sheet_list = tutormodel.sheets_from_xml(
+                        self.store.export_sheets())
+                self.group = tutormodel.group_from_xml(
+                        self.store.export_group(self.groupname))
+        else:
+            if self.shared_sheets is not None:
+                self.sheet_list = self.shared_sheets
+            else:
+                self.sheet_list = load_xml(self.sheetsfile, 'sheets')
+            if self.lazy:
+                self.group_key = file_key(self.groupfile)
+                self.group = load_group_lazy(self.groupfile)
+            else:
+                self.group = load_xml(self.groupfile, 'group')
+        # sheets whose scores are read, see load_scores
+        self.loaded_sheets = set()
+        self.all_loaded = not self.lazy
+        self.update_probs()
         self.update_names()
+        # apply the changes saved in the journals
+        if self.store is None and self.daemon is None:
+            if self.shared_sheets is None:
+                self.replay_journal(self.sheetsfile)
+            self.replay_journal(self.groupfile)
+        self.clear_pending()
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def do_export(self, arg):
+        "Export the standings of all students: export <csv|jsonl> <file|->"
+        args = arg.split(None, 1)
+        if len(args) != 2 or args[0] not in EXPORT_FORMATS:
+            print("Usage: export <{}> <file|->".format(
+                "|".join(EXPORT_FORMATS)))
+            return
+        self.export(*args)
+
+    def do_exportxml(self, arg):
+        "Write sheets and group saved in the database to the XML files."
+        if self.store is None:
+            print("No database in use, see --sqlite.")
+            return
+        write_xml(self.store.export_sheets(), self.sheetsfile)
+        write_xml(self.store.export_group(self.groupname), self.groupfile)
+        if self.pending:
+            print("{} unsaved changes were not exported, 'write' them "
+                  "first.".format(len(self.pending)))
+
+    def do_importxml(self, arg):
+        "Replace sheets and group in the database by the XML files."
+        if self.store is None:
+            print("No database in use, see --sqlite.")
+            return
+        if not self.prompt_yes_no('importxml.confirm',
+                "Discard sheets and group in the database?", 'no'):
+            return
+        self.store.import_sheets(parse_xml(self.sheetsfile).getroot())
+        self.store.import_group(self.groupname,
+                                parse_xml(self.groupfile).getroot())
+        self.do_reload(arg)
+
+    def do_check(self, arg):
+        "Check sheets and group for missing, duplicate or invalid values."
+        problems = self.check()
+        for problem in problems:
+            print(problem)
+        if not problems:
+            print("No problems found.")
 
     def do_print(self, arg):
-        "Create a LaTeX file with table for sheet <arg>"
-        self.print_table(arg)
+        "Create a table for sheet <arg>: print <sheet> [extable|tabular|csv]"
+        args = arg.split()
+        if len(args) == 2 and args[1] not in TABLE_STYLES:
+            print("Unknown table style {}, choose one of {}.".format(
+                args[1], ", ".join(TABLE_STYLES)))
+        elif 1 <= len(args) <= 2:
+            self.print_table(*args)
+        else:
+            print("Usage: print <sheet> [extable|tabular|csv]")
+
+    def do_stale(self, arg):
+        "List the LaTeX files whose data changed since they were created."
+        stale = self.stale_outputs()
+        for filename in stale:
+            print(filename)
+        if not stale:
+            print("All LaTeX files are up to date.")
+
+    def do_averages(self, arg):
+        "Print the average score of each problem of sheet <arg>"
+        self.print_averages(arg)
+
+    def do_rank(self, arg):
+        "Show the best and worst <arg> students and the score distributions."
+        self.print_ranking(int(arg) if arg.isdigit() else RANK_COUNT)
 
     def do_scheine(self, arg):
         "Print LaTeX file for the Scheine"
         self.print_scheine()
 
+    def do_stats(self, arg):
+        "Show command timings and call counts, or save them to file <arg>."
+        if arg:
+            with open(arg, 'w') as fstats:
+                self.dump_stats(fstats)
+            counters['file writes'] += 1
+            return
+        self.print_stats()
+
+    def do_profile(self, arg):
+        "Run command <arg> under cProfile and show the top functions."
+        profiler = cProfile.Profile()
+        stop = profiler.runcall(self.onecmd, arg)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+        return stop
+
     def do_quit(self, arg):
         "Quit the crafty tutor."
-        return ask_yes_no("Are you sure?", 'no')
+        # a script quits when it says so
+        if not self.prompt_yes_no('quit.confirm', "Are you sure?",
+                                  'yes' if self.batch else 'no'):
+            return False
+        if self.pending and self.prompt_yes_no('quit.save',
+                "Save {} unsaved changes?".format(len(self.pending)), 'yes'):
+            self.do_write(None)
+        # unsaved changes are dropped on purpose now
+        self.stop_autosave()
+        self.clear_pending()
+        if self.daemon is not None:
+            self.daemon.close()
+        return True
+
+    ####################################################################
+    # Apply changes of the data                                        #
+    ####################################################################
+
+    def mutate(self, *record):
+        """Apply a change and keep it as pending for the next write.
+
+        A record is a list of the change type followed by its arguments,
+        e.g. ['addboard', name, count]. It is applied by apply_<type>.
+        The change can be undone, see undo.
+        """
+        self.redo_stack = []
+        self.change(list(record))
+
+    def change(self, record):
+        """Apply a change record, keep it as pending and remember its
+        inverse for undo. Return whether the change was applied."""
+        inverse = self.submit(record)
+        if inverse is None:
+            return False
+        self.undo_stack.append((record, inverse))
+        return True
+
+    def submit(self, record):
+        """Apply a change record and keep it as pending.
+
+        With a daemon the record is applied by the daemon first, and
+        locally in its order with the changes of other tutors. Return
+        the record undoing the change, computed from the data it was
+        applied to, or None if the change was rejected.
+        """
+        if self.daemon is not None:
+            inverse = self.sync(record)
+            if inverse is None:
+                return None
+        else:
+            inverse = self.inverse(record)
+            self.apply(record)
+        self.add_pending(record)
+        return inverse
+
+    def sync(self, record=None):
+        """Send a change record to the daemon and apply the changes made
+        since the last sync in order.
+
+        Return the inverse of the record computed by the daemon, None if
+        there is no record or the daemon rejected it.
+        """
+        response = self.daemon.request('sync', record=record)
+        if 'error' in response:
+            print("Cannot apply change {}: {}".format(
+                describe_record(record), response['error']))
+            return None
+        others = 0
+        for own, change in response['changes']:
+            try:
+                self.apply(change)
+            except (KeyError, TypeError, AttributeError, ValueError):
+                print("Cannot apply change {}.".format(change))
+            if not own:
+                others += 1
+        if others:
+            print("Applied {} changes of other tutors.".format(others))
+        return response['inverse']
+
+    def add_pending(self, record):
+        """Keep a record as pending and tell the autosave thread."""
+        with self.lock:
+            self.pending.append(record)
+            self.autosave_changes += 1
+            self.autosave_cond.notify()
+
+    def undo(self):
+        """Undo the last change by applying its inverse.
+
+        A change that is still pending is just dropped, otherwise the
+        inverse becomes pending, so saved changes are undone in the files
+        with the next write. With a daemon the inverse is always sent.
+        Return the undone record or None.
+        """
+        if not self.undo_stack:
+            return None
+        record, inverse = self.undo_stack.pop()
+        with self.lock:
+            dropped = (self.daemon is None and bool(self.pending)
+                       and self.pending[-1] is record)
+            if dropped:
+                self.pending.pop()
+                self.autosave_changes += 1
+                self.autosave_cond.notify()
+        if dropped:
+            self.apply(inverse)
+        elif self.submit(inverse) is None:
+            self.undo_stack.append((record, inverse))
+            return None
+        self.redo_stack.append(record)
+        return record
+
+    def redo(self):
+        """Apply the last undone change again. Return it or None."""
+        if not self.redo_stack:
+            return None
+        record = self.redo_stack.pop()
+        if not self.change(record):
+            self.redo_stack.append(record)
+            return None
+        return record
+
+    def clear_pending(self):
+        """Forget the pending changes after they are saved or discarded.
+
+        An autosave running meanwhile is waited for and its recovery file
+        removed, one started before is not written anymore.
+        """
+        with self.lock:
+            self.pending = []
+            self.autosave_changes = 0
+            self.save_count += 1
+        # the recovery file belongs to the daemon
+        if self.daemon is not None:
+            return
+        with self.autosave_lock:
+            try:
+                os.remove(self.groupfile + ".autosave")
+            except FileNotFoundError:
+                pass
+
+    def autosave_loop(self, interval):
+        """Save the pending changes to the recovery file in the background.
+
+        Saves at most interval seconds after the first unsaved change or
+        once AUTOSAVE_CHANGES changes are unsaved. The changes are copied
+        under 'lock' and written without holding it, so commands never
+        wait for the disk.
+        """
+        while True:
+            with self.autosave_cond:
+                self.autosave_cond.wait_for(
+                        lambda: self.autosave_changes or self.autosave_stop)
+                self.autosave_cond.wait_for(
+                        lambda: (self.autosave_changes >= AUTOSAVE_CHANGES
+                                 or self.autosave_stop), interval)
+                if self.autosave_stop:
+                    return
+                records = list(self.pending)
+                save_count = self.save_count
+                self.autosave_changes = 0
+            with self.autosave_lock:
+                # skip if the changes were saved or discarded meanwhile
+                if save_count == self.save_count:
+                    write_autosave(self.groupfile + ".autosave",
+                                   self.autosave_key(), records)
+
+    def stop_autosave(self):
+        """Stop the autosave thread."""
+        with self.autosave_cond:
+            self.autosave_stop = True
+            self.autosave_cond.notify()
+
+    def autosave_key(self):
+        """Return mtime and size of the files the pending changes apply
+        to, None for missing ones."""
+        key = []
+        for filename in (self.sheetsfile, self.sheetsfile + ".journal",
+                         self.groupfile, self.groupfile + ".journal"):
+            try:
+                key.append(file_key(filename)[1:])
+            except OSError:
+                key.append(None)
+        return key
+
+    def read_autosave(self):
+        """Return the change records of the recovery file.
+
+        The recovery file is left by a session that ended without saving
+        or discarding its changes. It is ignored if the files changed
+        since. Return None if there is nothing to recover.
+        """
+        autosavefile = self.groupfile + ".autosave"
+        try:
+            key, records = read_autosave(autosavefile)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            print("Ignoring unreadable {}.".format(autosavefile))
+            return None
+        if key != self.autosave_key():
+            print("Ignoring {}, the files changed since.".format(autosavefile))
+            return None
+        return records
+
+    def recover_autosave(self, records):
+        """Offer to restore the changes of the recovery file as pending.
+
+        In batch mode they are only restored if 'autosave.recover' is
+        answered, otherwise the recovery file is kept for a later session.
+        """
+        if self.batch and self.get_answer('autosave.recover') is None:
+            # reloading removed the recovery file, put it back
+            with self.autosave_lock:
+                write_autosave(self.groupfile + ".autosave",
+                               self.autosave_key(), records)
+            print("Kept {} unsaved changes of the last session, answer "
+                  "autosave.recover to recover them.".format(len(records)))
+            return
+        if not self.prompt_yes_no('autosave.recover',
+                "Recover {} unsaved changes of the last session?".format(
+                    len(records)), 'yes'):
+            return
+        for record in records:
+            try:
+                self.mutate(*record)
+            except (KeyError, TypeError, AttributeError, ValueError):
+                print("Cannot apply saved change {}.".format(record))
+        # reloading removed the recovery file, keep the changes safe
+        with self.autosave_lock:
+            write_autosave(self.groupfile + ".autosave", self.autosave_key(),
+                           self.pending)
+        print("Use 'write' to save them.")
+
+    def pending_by_file(self):
+        """Split the pending changes by the file they belong to.
+
+        Return a list of (filename, records) for both files.
+        """
+        sheets_records = []
+        group_records = []
+        for record in self.pending:
+            if record[0] in SHEETS_RECORDS:
+                sheets_records.append(record)
+            else:
+                group_records.append(record)
+        return [(self.sheetsfile, sheets_records),
+                (self.groupfile, group_records)]
+
+    def apply(self, record):
+        """Apply a change record to the data."""
+        getattr(self, 'apply_' + record[0])(*record[1:])
+
+    def inverse(self, record):
+        """Return the record undoing a change record, computed by
+        inverse_<type> before the change is applied."""
+        return getattr(self, 'inverse_' + record[0])(*record[1:])
+
+    def inverse_titles(self, title, subtitle):
+        return ['titles', self.group.title, self.group.subtitle]
+
+    def inverse_student(self, name, studid):
+        return ['unstudent', name]
+
+    def inverse_id(self, name, studid):
+        return ['id', name, self.students[name].id]
+
+    def inverse_board(self, name, board):
+        return ['board', name, str(self.students[name].board)]
+
+    def inverse_addboard(self, name, count):
+        return ['addboard', name, -count]
+
+    def inverse_sheet(self, no, probs):
+        return ['unsheet', no]
+
+    def inverse_scores(self, name, sheetno, scores):
+        self.load_scores(sheetno)
+        old = self.students[name].sheets.get(sheetno)
+        if old is None:
+            return ['unscores', name, sheetno]
+        return ['scores', name, sheetno,
+                {prob: score.text for prob, score in old.items()}]
+
+    def inverse_unstudent(self, name):
+        return ['student', name, self.last_student(name).id]
+
+    def inverse_unsheet(self, no):
+        return ['sheet', no, [[prob.no, prob.type, prob.text]
+                              for prob in self.last_sheet(no).probs]]
+
+    def inverse_unscores(self, name, sheetno):
+        return self.inverse_scores(name, sheetno, {})
+
+    def apply_titles(self, title, subtitle):
+        """Set title and subtitle of the group."""
+        self.group.title = title
+        self.group.subtitle = subtitle
+
+    def apply_student(self, name, studid):
+        """Add a new student."""
+        newstud = tutormodel.Student(name, studid, 0)
+        self.group.students.append(newstud)
+        self.index_student(newstud)
+
+    def apply_id(self, name, studid):
+        """Change the id of a student."""
+        student = self.students[name]
+        if student.id and self.studids.get(student.id) is student:
+            del self.studids[student.id]
+            self.unindex_name(student.id)
+        student.id = studid
+        if studid:
+            self.studids[studid] = student
+            self.name_index.add(studid)
+
+    def apply_board(self, name, board):
+        """Set the number of presented problems of a student."""
+        self.students[name].board = int(board)
+
+    def apply_addboard(self, name, count):
+        """Add to the number of presented problems of a student.
+
+        Unlike board the changes of several tutors add up.
+        """
+        student = self.students[name]
+        if not isinstance(student.board, int):
+            raise ValueError("board count {!r} of {} is no number".format(
+                student.board, name))
+        student.board += int(count)
+
+    def apply_sheet(self, no, probs):
+        """Add a new sheet with a list of [number, type, points]."""
+        sheet = tutormodel.Sheet(no, [
+            tutormodel.Problem(probno, probtype, probpoints)
+            for probno, probtype, probpoints in probs])
+        self.sheet_list.append(sheet)
+        self.index_sheet(sheet)
+
+    def apply_scores(self, name, sheetno, scores):
+        """Store the scores of a student for a sheet.
+
+        Problems not in the dict scores keep their old entry.
+        """
+        self.load_scores(sheetno)
+        stud = self.students[name]
+        old = stud.sheets.get(sheetno, {})
+        # the scores follow the order of the problems of the sheet
+        newscores = {}
+        for prob in self.sheets[sheetno].probs:
+            if prob.no in scores:
+                newscores[prob.no] = tutormodel.Score(scores[prob.no])
+            else:
+                newscores[prob.no] = old.get(prob.no) or tutormodel.Score("")
+        new_sheet = sheetno not in stud.sheets
+        stud.sheets[sheetno] = newscores
+        if new_sheet:
+            # e.g. scores restored by undo go back to the place of their sheet
+            positions = {sheet.no: pos
+                         for pos, sheet in enumerate(self.sheet_list)}
+            stud.sheets = dict(sorted(
+                    stud.sheets.items(),
+                    key=lambda item: positions.get(item[0], len(positions))))
+        self.update_score_row(stud, sheetno)
+
+    def apply_unstudent(self, name):
+        """Remove the last student, who has the given name."""
+        stud = self.last_student(name)
+        self.group.students.pop()
+        self.names.pop()
+        if self.students.get(name) is stud:
+            del self.students[name]
+            self.unindex_name(name)
+        if stud.id and self.studids.get(stud.id) is stud:
+            del self.studids[stud.id]
+            self.unindex_name(stud.id)
+        del self.stud_rows[stud]
+        self.score_rows.pop()
+        self.scored_rows.pop()
+        self.name_completer = None
+
+    def apply_unsheet(self, no):
+        """Remove the last sheet, which has the given number."""
+        sheet = self.last_sheet(no)
+        self.sheet_list.pop()
+        if self.sheets.get(no) is not sheet:
+            # another sheet has the same number and shares its columns
+            self.update_probs()
+            self.update_names()
+            return
+        del self.sheets[no]
+        cols = set()
+        for prob in sheet.probs:
+            self.probs.pop((no, prob.no), None)
+            col = self.prob_cols.pop((no, prob.no), None)
+            if col is not None:
+                cols.add(col)
+        # the columns of the last sheet are the last ones
+        if cols:
+            first = min(cols)
+            del self.col_types[first:]
+            del self.col_points[first:]
+            del self.mask_w[first:]
+            del self.mask_v[first:]
+            for row in self.score_rows:
+                del row[first:]
+            for row in self.scored_rows:
+                del row[first:]
+
+    def last_student(self, name):
+        """Return the last student, raise ValueError if the name is not
+        the one of the last student.
+
+        Another tutor may have added a student after this one.
+        """
+        if not self.group.students or self.group.students[-1].name != name:
+            raise ValueError("{} is not the last student".format(name))
+        return self.group.students[-1]
+
+    def last_sheet(self, no):
+        """Return the last sheet, raise ValueError if no is not the number
+        of the last sheet."""
+        if not self.sheet_list or self.sheet_list[-1].no != no:
+            raise ValueError("sheet {} is not the last sheet".format(no))
+        return self.sheet_list[-1]
+
+    def apply_unscores(self, name, sheetno):
+        """Remove the scores of a student for a sheet."""
+        self.load_scores(sheetno)
+        stud = self.students[name]
+        scores = stud.sheets.pop(sheetno, {})
+        row = self.stud_rows[stud]
+        for prob_no in scores:
+            col = self.prob_cols.get((sheetno, prob_no))
+            if col is not None:
+                self.score_rows[row][col] = 0.0
+                self.scored_rows[row][col] = 0
 
     ####################################################################
     # Member functions implementing functionality                      #
     ####################################################################
 
+    def get_answer(self, key):
+        """Return the answer to the prompt key or None if there is none.
+
+        Keys are dotted, e.g. 'ratesheet.score.<problem>.<name>'. Without
+        an answer for the full key, the answers for the shorter keys
+        'ratesheet.score.<problem>', 'ratesheet.score' are used.
+        """
+        while key:
+            if key in self.answers:
+                return self.answers[key]
+            key = key.rpartition('.')[0]
+        return None
+
+    def prompt_value(self, key, prompt, default=None, required=False):
+        """Prompt for a value unless it is answered by 'answers'.
+
+        @key: key of the answer, None if the prompt cannot be answered
+        @prompt: prompt shown to the user
+        @default: value returned on empty input
+        @required: do not use the default in batch mode
+
+        In batch mode, a prompt without answer returns its default or, if
+        there is none or it is required, raises EOFError like Ctrl+D.
+        """
+        answer = self.get_answer(key)
+        if answer is not None:
+            return answer
+        if self.batch:
+            if default is None or required:
+                raise EOFError
+            return str(default)
+        if default is None:
+            return input("{}: ".format(prompt))
+        return input_def(prompt, default)
+
+    def prompt_yes_no(self, key, question, default):
+        """Ask a yes or no question unless it is answered by 'answers'.
+
+        In batch mode, questions without answer return the default.
+        """
+        answer = self.get_answer(key)
+        if answer is not None:
+            return answer.strip().lower() in ('y', 'ye', 'yes', 'true', '1')
+        if self.batch:
+            return default == 'yes'
+        return ask_yes_no(question, default)
+
+    def reject(self, key, message):
+        """Reject an invalid value of a prompt.
+
+        A value from 'answers' cannot be corrected, so it aborts the
+        prompt by raising EOFError.
+        """
+        print(message)
+        if self.batch or self.get_answer(key) is not None:
+            raise EOFError
+
+    def run_script(self, fscript):
+        """Run the commands of a script file line by line.
+
+        Empty lines and lines starting with '#' are skipped. Stops at the
+        end of the file or when a command quits.
+        """
+        for line in fscript:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            print("{}{}".format(self.prompt, line))
+            line = self.precmd(line)
+            stop = self.onecmd(line)
+            if self.postcmd(stop, line):
+                break
+
     def init_xml(self, filename):
         """Initialize a xml file with an empty data block."""
-        root = ET.Element('data')
-        tree = ET.ElementTree(root)
-        tree.write(filename)
+        write_xml(ET.Element('data'), filename)
 
     def update_names(self):
-        """Update the global list 'names'."""
+        """Update the global list 'names' and the student indices.
+
+        'students' maps the name and 'studids' the id of a student to the
+        student.
+
+        The score matrix holds a row per student in order and a column
+        per problem. 'score_rows' holds the parsed scores with 0 for
+        missing ones, 'scored_rows' 1 for given and 0 for missing scores.
+        'stud_rows' maps a student to its row.
+
+        'name_index' holds the names and ids for fuzzy matching. It is
+        kept, only names and ids added or gone are indexed or removed.
+        """
+        counters['index rebuilds'] += 1
         self.names = []
-        xnames = self.root_group.findall('./student/name')
-        for xn in xnames:
-            self.names.append(xn.text)
+        self.students = {}
+        self.studids = {}
+        self.stud_rows = {}
+        self.score_rows = []
+        self.scored_rows = []
+        self.name_completer = None
+        for stud in self.group.students:
+            self.index_student(stud)
+        self.name_index.retain(self.students.keys() | self.studids.keys())
+
+    def index_student(self, stud):
+        """Add a student to the list 'names', the student indices and the
+        score matrix."""
+        self.stud_rows[stud] = len(self.score_rows)
+        self.score_rows.append(array.array('d', bytes(8 * len(self.col_types))))
+        self.scored_rows.append(bytearray(len(self.col_types)))
+        for sheet_no in stud.sheets:
+            self.update_score_row(stud, sheet_no)
+        name = as_text(stud.name)
+        if name in self.students:
+            print("More than one student with name {}.".format(name),
+                    "Fix that!")
+        else:
+            self.students[name] = stud
+        self.names.append(name)
+        self.name_completer = None
+        self.name_index.add(name)
+        if stud.id:
+            self.studids[stud.id] = stud
+            self.name_index.add(stud.id)
+
+    def unindex_name(self, key):
+        """Remove a name or id from 'name_index' unless another student
+        still has it as name or id."""
+        if key not in self.students and key not in self.studids:
+            self.name_index.remove(key)
+
+    def choose_student(self, key):
+        """Get a student by name or id, offering the most similar names
+        and ids for a misspelled one.
+
+        Return None if the user chose none.
+        """
+        student = self.find_student(key)
+        if student is not None:
+            return student
+        candidates = self.name_index.search(key,
+                                            stringcompleter.FUZZY_MATCHES)
+        if not candidates:
+            print("Unknown student. Stop making up names!")
+            return None
+        print("Unknown student. Did you mean")
+        for i, candidate in enumerate(candidates, 1):
+            print("  {}) {}".format(i, candidate))
+        try:
+            choice = self.prompt_value(None, "Number (empty for none)")
+        except:
+            print()
+            return None
+        if choice.isdigit() and 1 <= int(choice) <= len(candidates):
+            return self.find_student(candidates[int(choice) - 1])
+        return None
+
+    def find_student(self, key):
+        """Get a student by name or id.
+
+        Return None if there is no such student.
+        """
+        stud = self.students.get(key)
+        if stud is None:
+            stud = self.studids.get(key)
+        return stud
+
+    def load_scores(self, sheet=None):
+        """Read the scores of a sheet or of all sheets in lazy mode.
+
+        The group file is read with iterparse, keeping only the scores
+        of the requested sheets. Scores already read are kept, so they
+        may have been changed in the meantime.
+
+        @sheet: sheet number, None for all sheets
+        """
+        if self.all_loaded or sheet in self.loaded_sheets:
+            return
+        if file_key(self.groupfile) != self.group_key:
+            print("Warning: {} changed since it was loaded, use 'reload'."
+                  .format(self.groupfile))
+        sheet_nos = None if sheet is None else {sheet}
+        filestuds = (value for tag, value
+                     in iterparse_students(self.groupfile, sheet_nos)
+                     if tag == 'student')
+        with gc_paused():
+            for stud, filestud in zip(self.group.students, filestuds):
+                if stud.name != filestud.name:
+                    print("Warning: cannot read scores of {}.".format(
+                        stud.name))
+                    continue
+                for sheet_no, scores in filestud.sheets.items():
+                    if sheet_no not in self.loaded_sheets:
+                        stud.sheets[sheet_no] = scores
+                        self.update_score_row(stud, sheet_no)
+        if sheet is None:
+            self.all_loaded = True
+        else:
+            self.loaded_sheets.add(sheet)
+
+    def check(self):
+        """Check sheets and group for consistency.
+
+        The result for unchanged files is read from the cache file
+        <group>.check, which is keyed on the hashes of the XML files and
+        their journals. Unsaved changes and databases are always checked.
+        In lazy mode the scores are checked while reading them, see
+        checked_students.
+
+        Return a list of the problems found.
+        """
+        if self.store is not None or self.daemon is not None or self.pending:
+            return check_model(self.sheet_list, self.group,
+                               self.checked_students())
+        cachefile = self.output_filename("{}.check")
+        key = [file_hash(filename) for filename in (
+            self.sheetsfile, self.sheetsfile + ".journal",
+            self.groupfile, self.groupfile + ".journal")]
+        try:
+            with open(cachefile) as fcache:
+                cache = json.load(fcache)
+            if cache['key'] == key:
+                return cache['problems']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        problems = check_model(self.sheet_list, self.group,
+                               self.checked_students())
+        try:
+            with open(cachefile, 'w') as fcache:
+                json.dump({'key': key, 'problems': problems}, fcache)
+        except OSError:
+            pass
+        return problems
+
+    def checked_students(self):
+        """Return the students with all their scores for check.
+
+        In lazy mode the scores not read yet are read from the group file
+        one student at a time and not kept, only the scores of the
+        current student are in memory.
+        """
+        if self.all_loaded:
+            return self.group.students
+        return self.iter_full_students()
+
+    def iter_full_students(self):
+        """Generate copies of the students with the scores of the sheets
+        not read yet taken from the group file, see checked_students."""
+        filestuds = (value for tag, value
+                     in iterparse_students(self.groupfile, None)
+                     if tag == 'student')
+        for stud in self.group.students:
+            filestud = next(filestuds, None)
+            full = tutormodel.Student(stud.name, stud.id, stud.board)
+            # students added since have no scores in the file
+            if filestud is not None and filestud.name == stud.name:
+                full.sheets = {sheet_no: scores for sheet_no, scores
+                               in filestud.sheets.items()
+                               if sheet_no not in self.loaded_sheets}
+            full.sheets.update(stud.sheets)
+            yield full
+
+    def save_xml(self, filename):
+        """Write sheets or group to its XML file and remove its merged
+        journal."""
+        if filename == self.sheetsfile:
+            write_lines(sheets_xml_lines(self.sheet_list), filename)
+        else:
+            self.load_scores()
+            write_lines(group_xml_lines(self.group), filename)
+            if self.lazy:
+                self.group_key = file_key(filename)
+        try:
+            os.remove(filename + ".journal")
+        except FileNotFoundError:
+            pass
+
+    def replay_journal(self, xmlfile):
+        """Apply the changes saved in the journal of a xml file."""
+        records = read_journal(xmlfile)
+        for record in records:
+            try:
+                self.apply(record)
+            except (KeyError, TypeError, AttributeError, ValueError):
+                print("Cannot apply saved change {}.".format(record))
+        if records:
+            print("Replayed {} saved changes from {}.journal."
+                  .format(len(records), xmlfile))
+
+    def record_timing(self, line):
+        """Add the measurements of a finished command to 'cmd_stats'."""
+        wall = time.perf_counter() - self.cmd_start[0]
+        cpu = time.process_time() - self.cmd_start[1]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        command = line.split()[0] if line.split() else ''
+        if not command:
+            return
+        stat = self.cmd_stats.setdefault(command,
+                {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0})
+        stat['calls'] += 1
+        stat['wall'] += wall
+        stat['cpu'] += cpu
+        stat['peak'] = max(stat['peak'], peak)
+
+    def print_stats(self):
+        """Print the measurements of the commands and the call counters."""
+        if not self.timing:
+            print("Timing is off, start with --timing to measure commands.")
+        elif self.cmd_stats:
+            print("{:<14} {:>6} {:>10} {:>10} {:>12}".format(
+                "command", "calls", "wall [s]", "cpu [s]", "peak [KiB]"))
+            for command, stat in sorted(self.cmd_stats.items(),
+                    key=lambda item: item[1]['cpu'], reverse=True):
+                print("{:<14} {:>6} {:>10.3f} {:>10.3f} {:>12.0f}".format(
+                    command, stat['calls'], stat['wall'], stat['cpu'],
+                    stat['peak'] / 1024))
+            print()
+        for name, count in sorted(counters.items()):
+            print("{:<18} {:>10}".format(name, count))
+
+    def dump_stats(self, fstats):
+        """Write the measurements and call counters as JSON to a file."""
+        json.dump({'commands': self.cmd_stats, 'counters': counters},
+                  fstats, indent=2)
+
+    def update_probs(self):
+        """Update the global index 'probs' of all problems.
+
+        Maps (sheet number, problem number) to (type, maximum points).
+        'sheets' maps the sheet number to the sheet.
+
+        Each problem also gets a column of the score matrix, see
+        update_names. 'prob_cols' maps (sheet number, problem number) to
+        the column, 'col_types' and 'col_points' hold type and maximum
+        points of each column. 'mask_w' and 'mask_v' mark the columns of
+        written and of vote problems, for itertools.compress.
+        """
+        self.probs = {}
+        self.sheets = {}
+        self.prob_cols = {}
+        self.col_types = []
+        self.col_points = array.array('d')
+        self.mask_w = bytearray()
+        self.mask_v = bytearray()
+        self.score_rows = []
+        self.scored_rows = []
+        for sheet in self.sheet_list:
+            self.index_sheet(sheet)
+
+    def index_sheet(self, sheet):
+        """Add the problems of a sheet to the index 'probs'."""
+        self.sheets.setdefault(sheet.no, sheet)
+        for prob in sheet.probs:
+            key = (sheet.no, prob.no)
+            points = prob.points or 0.0
+            self.probs[key] = (prob.type, points)
+            # add column to the score matrix
+            col = self.prob_cols.get(key)
+            if col is None:
+                self.prob_cols[key] = len(self.col_types)
+                self.col_types.append(prob.type)
+                self.col_points.append(points)
+                self.mask_w.append(prob.type == 'w')
+                self.mask_v.append(prob.type == 'v')
+                for row in self.score_rows:
+                    row.append(0.0)
+                for row in self.scored_rows:
+                    row.append(0)
+            else:
+                self.col_types[col] = prob.type
+                self.col_points[col] = points
+                self.mask_w[col] = prob.type == 'w'
+                self.mask_v[col] = prob.type == 'v'
+
+    def update_score_row(self, stud, sheet_no):
+        """Copy the scores of a sheet of a student into the score matrix.
+
+        Scores that are no numbers count as missing.
+        """
+        counters['score row updates'] += 1
+        row = self.stud_rows[stud]
+        scores = self.score_rows[row]
+        scored = self.scored_rows[row]
+        for prob_no, score in stud.sheets[sheet_no].items():
+            col = self.prob_cols.get((sheet_no, prob_no))
+            if col is None:
+                continue
+            if score.value is None:
+                scores[col] = 0.0
+                scored[col] = 0
+            else:
+                scores[col] = score.value
+                scored[col] = 1
 
     def set_empty_completion(self):
         """Switch off readline completion."""
-        completer = stringcompleter.StringCompleter([])
-        readline.set_completer(completer.complete)
+        readline.set_completer(empty_completer.complete)
 
     def set_name_completion(self):
-        """Use readline completion for the students names."""
-        completer = stringcompleter.StringCompleter(self.names)
-        readline.set_completer(completer.complete)
+        """Use readline completion for the students names.
+
+        The completer is built once and reused until the names change.
+        Text matching no name is completed by similar names and ids.
+        """
+        if self.name_completer is None:
+            self.name_completer = stringcompleter.StringCompleter(
+                    self.names, self.name_index)
+        readline.set_completer(self.name_completer.complete)
 
     def get_sheet(self, sheet):
-        """Get the xml tree of a sheet."""
+        """Get a sheet by its number."""
         if not sheet:
             print("Specify sheet number.")
             return
-        lcursheet = self.root_sheets.findall("./sheet[@no={}]"
-                                             .format(stringToXPath(sheet)))
+        lcursheet = [cursheet for cursheet in self.sheet_list
+                     if cursheet.no == sheet]
         if len(lcursheet) == 0:
             print("Sheet not defined. Use 'newsheet' first.")
             return
@@ -184,93 +1317,96 @@ class CraftyTutor(cmd.Cmd):
     def settitles(self):
         """Set title and subtitle of a new group."""
         try:
-            title = input("Title: ")
-            subtitle = input("Subtitle (will be expanded by sheet no): ")
+            title = self.prompt_value('group.title', "Title")
+            subtitle = self.prompt_value('group.subtitle',
+                    "Subtitle (will be expanded by sheet no)")
         except:
             print()
             return
-        xtitle = ET.SubElement(self.root_group, 'title')
-        xtitle.text = title
-        xsubtitle = ET.SubElement(self.root_group, 'subtitle')
-        xsubtitle.text = subtitle
+        self.mutate('titles', title, subtitle)
 
     def addstudents(self):
         """Add students and ids til empty name is entered."""
         print("Return at empty name")
         while True:
             try:
-                name = input("Name: ")
+                name = self.prompt_value(None, "Name")
             except:
                 print()
                 return
             if not len(name):
                 break
             try:
-                studid = input("ID:   ")
+                studid = self.prompt_value(None, "ID  ")
             except:
                 print()
                 return
-            # new element
-            newstud = ET.Element('student')
-            # add name
-            xname = ET.SubElement(newstud, 'name')
-            xname.text = name
-            # add board
-            xboard = ET.SubElement(newstud, 'board')
-            xboard.text = '0'
-            # add id
-            xstudid = ET.SubElement(newstud, 'id')
-            if len(studid):
-                xstudid.text = studid
-            # add to root
-            self.root_group.append(newstud)
+            self.mutate('student', name, studid)
 
     def addids(self):
         """Manipulate or add student ids."""
-        for student in self.root_group.findall('student'):
-            print(student.find('name').text)
-            studid = student.find('id')
+        for student in self.group.students:
+            name = student.name
+            print(name)
             try:
-                if studid.text:
-                    newid = input_def('ID', studid.text)
-                else:
-                    newid = input("ID: ")
+                newid = self.prompt_value(None, "ID", student.id or None)
             except:
                 print()
                 return
-            studid.text = newid
+            if newid != as_text(student.id):
+                self.mutate('id', name, newid)
 
     def newsheet(self):
         """Interatively add a new problem sheet."""
         # get highest sheet number
         print("Return with Ctrl+D")
         no = 0
-        for sheets in self.root_sheets.findall('sheet'):
+        for sheet in self.sheet_list:
             try:
-                curno = int(sheets.attrib['no'])
+                curno = int(sheet.no)
             except ValueError:
                 continue
             if curno > no:
                 no = curno
         # ask for number
         try:
-            no = input_def("Number", no+1)
+            no = self.prompt_value('newsheet.number', "Number", no+1)
         except:
             print()
             return
+        if no in self.sheets:
+            print("Sheet {} exists already.".format(no))
+            return
 
-        # create element
-        xsheet = ET.Element('sheet', {'no': no})
+        # collect [number, type, points] of the problems
+        newprobs = []
+        answer = self.get_answer('newsheet.problems')
+        if answer is not None or self.batch:
+            # given as 'number:type:points ...'
+            for spec in (answer or "").replace(',', ' ').split():
+                prob = spec.split(':')
+                if (len(prob) != 3 or prob[1] not in ('v', 'w')
+                        or not prob[2].isdigit()):
+                    print("Invalid problem '{}', use number:type:points."
+                          .format(spec))
+                    return
+                if prob[0] in [newprob[0] for newprob in newprobs]:
+                    print("Problem {} is given twice.".format(prob[0]))
+                    return
+                newprobs.append(prob)
+            self.mutate('sheet', no, newprobs)
+            return
 
         # get highest problem number
         probno = 0
-        for probs in self.root_sheets.iter('prob'):
-            try:
-                curprob = int(probs.attrib['no'])
-            except ValueError:
-                continue
-            if curprob > probno:
-                probno = curprob
+        for sheet in self.sheet_list:
+            for prob in sheet.probs:
+                try:
+                    curprob = int(prob.no)
+                except ValueError:
+                    continue
+                if curprob > probno:
+                    probno = curprob
         # ask for problems
         while True:
             try:
@@ -278,14 +1414,14 @@ class CraftyTutor(cmd.Cmd):
             except ValueError:
                 iprobno = 0
             try:
-                probno = input_def("\nProblem", iprobno+1)
+                probno = self.prompt_value(None, "\nProblem", iprobno+1)
                 while True:
-                    probtype = input_def("Type", 'v')
+                    probtype = self.prompt_value(None, "Type", 'v')
                     if probtype in "vw":
                         break
                     print("Only v and w allowed as type")
                 while True:
-                    probpoints = input("Points: ")
+                    probpoints = self.prompt_value(None, "Points")
                     if len(probpoints) and probpoints.isdigit():
                         break
                     print("Enter Points (only digits allowed)")
@@ -295,12 +1431,13 @@ class CraftyTutor(cmd.Cmd):
             except:
                 print()
                 return
-            xprob = ET.SubElement(xsheet, 'prob',
-                    {'no': probno, 'type': probtype})
-            xprob.text = probpoints
+            if probno in [newprob[0] for newprob in newprobs]:
+                print("Problem {} is already on the sheet.".format(probno))
+                continue
+            newprobs.append([probno, probtype, probpoints])
 
         # add to root
-        self.root_sheets.append(xsheet)
+        self.mutate('sheet', no, newprobs)
 
     def ratesheet(self, sheet):
         """Interactively rate the given sheet."""
@@ -311,10 +1448,11 @@ class CraftyTutor(cmd.Cmd):
 
         # ask which problems should be rated
         prob_numbers = []
-        for prob in cursheet.findall('prob'):
-            prob_no = prob.attrib['no']
-            do_rate = ask_yes_no("Rate problem {}({})?".format(
-                prob_no, prob.attrib["type"]), 'yes')
+        for prob in cursheet.probs:
+            prob_no = prob.no
+            do_rate = self.prompt_yes_no('ratesheet.rate.' + prob_no,
+                    "Rate problem {}({})?".format(prob_no, prob.type),
+                    'yes')
             if do_rate:
                 prob_numbers.append(prob_no)
         # break if no problems are rated
@@ -322,12 +1460,25 @@ class CraftyTutor(cmd.Cmd):
             return
 
         # either iterate over all students in list or choose each student
-        if ask_yes_no("Rate students in order?", 'yes'):
+        if self.prompt_yes_no('ratesheet.in_order', "Rate students in order?",
+                'yes'):
             self.ratesheet_iteratestuds(cursheet, prob_numbers)
         else:
             self.ratesheet_askforstud(cursheet, prob_numbers)
 
     def ratesheet_askforstud(self, cursheet, prob_numbers):
+        # students given as answer
+        answer = self.get_answer('ratesheet.students')
+        if answer is not None or self.batch:
+            for stud in (answer or "").split(';'):
+                stud = stud.strip()
+                student = self.find_student(stud)
+                if student is None:
+                    print("Unknown student '{}'.".format(stud))
+                    continue
+                print("\n{}".format(stud))
+                self.ratesheet_singlestud(cursheet, prob_numbers, student)
+            return
         # ask for students loop
         print("\nExit by entering empty name.")
         while True:
@@ -337,75 +1488,152 @@ class CraftyTutor(cmd.Cmd):
                 self.set_name_completion()
                 # ask for student
                 try:
-                    stud = input("\nStudent: ")
+                    stud = self.prompt_value(None, "\nStudent")
                 # exit on invalid input
                 except:
                     print()
                     return
-                # continue if correct name is given
-                if stud in self.names:
-                    break
                 # exit on empty input
                 if not stud:
                     return
-                # if we are here, student in not in list
-                print("Unknown student. Stop making up names!")
-            # get xml tree of student
-            xstud = self.root_group.find("student[name={}]"
-                                         .format(stringToXPath(stud)))
+                # continue if correct or corrected name is given
+                student = self.choose_student(stud)
+                if student is not None:
+                    break
             # rate this student
-            self.ratesheet_singlestud(cursheet, prob_numbers, xstud)
+            self.ratesheet_singlestud(cursheet, prob_numbers, student)
 
     def ratesheet_singlestud(self, cursheet, prob_numbers, stud):
-        # extract sheet number
-        sheetno = cursheet.attrib['no']
-        # create new sheet item
-        xsheet = ET.Element('sheet', {'no': sheetno})
+        scores = {}
         # iterate over all probs of the sheet
-        for prob in cursheet.findall('prob'):
-            probno = prob.attrib['no']
+        for prob in cursheet.probs:
+            probno = prob.no
             # rate problem
             if probno in prob_numbers:
                 maxscore = prob.text
-                xprob = ET.SubElement(xsheet, 'prob', {'no': probno})
+                key = 'ratesheet.score.{}.{}'.format(probno, stud.name)
                 # loop until valid value is given
                 while True:
                     try:
-                        score = input_def("Problem {}".format(probno),
-                                maxscore)
+                        score = self.prompt_value(key,
+                                "Problem {}".format(probno), maxscore,
+                                required=True)
+                        # consistency check
+                        try:
+                            fscore = float(score)
+                        except ValueError:
+                            self.reject(key, "Only numbers allowed")
+                            continue
                     except:
                         print()
                         return
-                    # consistency check
-                    try:
-                        fscore = float(score)
-                    except ValueError:
-                        print("Only numbers allowed")
-                        continue
                     break
-                # store score
-                xprob.text = score
-            # or keep old entry
-            else:
-                xprob = ET.SubElement(xsheet, 'prob', {'no': probno})
-                xprob.text = text_or_none(
-                        stud.find("./sheet[@no={}]/prob[@no={}]"
-                                  .format(stringToXPath(sheetno),
-                                          stringToXPath(probno))))
-        # delete existing
-        lold = stud.findall("./sheet[@no={}]"
-                            .format(stringToXPath(sheetno)))
-        for old in lold:
-            stud.remove(old)
-        # add to student
-        stud.append(xsheet)
+                scores[probno] = score
+        # store scores
+        self.set_scores(cursheet, stud, scores)
+
+    def set_scores(self, cursheet, stud, scores):
+        """Store the scores of a student for a sheet.
+
+        @cursheet: the sheet
+        @stud: the student
+        @scores: dict mapping problem numbers to scores, problems not in
+                 the dict keep their old entry
+        """
+        self.mutate('scores', stud.name, cursheet.no, scores)
 
     def ratesheet_iteratestuds(self, cursheet, prob_numbers):
         # iterate over all students and ask for scores
-        for stud in self.root_group.findall('student'):
-            print("\n{}".format(stud.find('name').text))
+        for stud in self.group.students:
+            print("\n{}".format(stud.name))
             self.ratesheet_singlestud(cursheet, prob_numbers, stud)
 
+    def importscores(self, sheet, filename):
+        """Import the scores of a sheet from a CSV or TSV file.
+
+        Each row holds the name or id of a student followed by the scores
+        of the problems of the sheet in order. An optional header row
+        names the problems of all columns instead (e.g. 'name,A3,A1').
+        Empty cells keep the old entry. Invalid rows are skipped and
+        reported after the import.
+
+        Return the number of students whose scores were imported.
+        """
+        cursheet = self.get_sheet(sheet)
+        if not cursheet:
+            return 0
+        prob_numbers = [prob.no for prob in cursheet.probs]
+        delimiter = '\t' if filename.endswith(('.tsv', '.tab')) else ','
+        try:
+            fscores = open(filename, newline='')
+        except OSError as e:
+            print("Cannot open {}: {}".format(filename, e.strerror))
+            return 0
+        columns = prob_numbers
+        imported = {}
+        errors = []
+        with fscores:
+            for lineno, row in enumerate(
+                    csv.reader(fscores, delimiter=delimiter), 1):
+                cells = [cell.strip() for cell in row]
+                # skip empty lines
+                if not any(cells):
+                    continue
+                # header row, only if all columns are named A<problem>,
+                # a misspelled student is reported as invalid row instead
+                if (lineno == 1 and self.find_student(cells[0]) is None
+                        and len(cells) > 1
+                        and all(c[:1] in ('A', 'a') and c[1:] in prob_numbers
+                                for c in cells[1:])):
+                    columns = [c[1:] for c in cells[1:]]
+                    continue
+                # data row
+                try:
+                    stud, scores = self.parse_score_row(cells, columns)
+                except ValueError as e:
+                    errors.append((lineno, str(e)))
+                    continue
+                if id(stud) in imported:
+                    errors.append((lineno, "student already imported in "
+                                   "line {}".format(imported[id(stud)])))
+                    continue
+                imported[id(stud)] = lineno
+                self.set_scores(cursheet, stud, scores)
+        print("Imported scores of {} students for sheet {}."
+              .format(len(imported), sheet))
+        if errors:
+            print("Skipped {} invalid rows:".format(len(errors)))
+            for lineno, msg in errors:
+                print("  line {}: {}".format(lineno, msg))
+        return len(imported)
+
+    def parse_score_row(self, cells, columns):
+        """Check a row of a score file and extract its scores.
+
+        @cells: name or id of the student followed by the scores
+        @columns: problem numbers of the score columns
+
+        Return the student and a dict mapping problem
+        numbers to scores. Raise ValueError if the row is invalid.
+        """
+        stud = self.find_student(cells[0])
+        if stud is None:
+            raise ValueError("unknown student '{}'".format(cells[0]))
+        if len(cells) - 1 != len(columns):
+            raise ValueError("expected {} scores, got {}"
+                             .format(len(columns), len(cells) - 1))
+        scores = {}
+        for probno, score in zip(columns, cells[1:]):
+            if not score:
+                continue
+            try:
+                float(score)
+            except ValueError:
+                raise ValueError("score '{}' of problem {} is not a number"
+                                 .format(score, probno)) from None
+            scores[probno] = score
+        return stud, scores
+
     def presented(self, sheet):
         """Interactively ask who presented the problems."""
         cursheet = self.get_sheet(sheet)
@@ -415,42 +1643,38 @@ class CraftyTutor(cmd.Cmd):
         # use name completion
         self.set_name_completion()
         # iterate over all problems
-        problems = cursheet.findall('./prob')
-        for prob in problems:
+        for prob in cursheet.probs:
             while True:
                 try:
-                    presenter = input("Problem {}: ".format(prob.attrib['no']))
+                    presenter = self.prompt_value(None,
+                            "Problem {}".format(prob.no))
                 except:
                     print()
                     return
-                if presenter in self.names:
-                    break
                 if not presenter:
                     break
-                print("Unknown student. Stop making up names!")
+                student = self.choose_student(presenter)
+                if student is not None:
+                    break
             if not presenter:
                 continue
             # increase number of presented problems
-            xboard = self.root_group.findall(
-                    "./student[name={}]/board"
-                    .format(stringToXPath(presenter)))
-            if len(xboard) != 1:
+            if not isinstance(student.board, int):
                 print("Panic!")
                 return
-            xboard[0].text = str(int(xboard[0].text) + 1)
+            self.mutate('addboard', student.name, 1)
 
     def get_total_points(self, problemtype):
         """Count total points of given problemtype
 
         @problemtype: either 'w' or 'v' for written or voted problems
         """
-        probs = self.root_sheets.findall(
-                "./sheet/prob[@type={}]"
-                .format(stringToXPath(problemtype)))
+        if self.store is not None and not self.pending:
+            return self.store.total_points(problemtype)
         total = 0.0
-        for prob in probs:
-            if prob.text:
-                total += float(prob.text)
+        for prob_type, points in self.probs.values():
+            if prob_type == problemtype:
+                total += points
         return total
 
     def get_points(self, sheet, problemtype):
@@ -459,13 +1683,12 @@ class CraftyTutor(cmd.Cmd):
         @sheet: sheet number
         @problemtype: either 'w' or 'v' for written or voted problems
         """
-        probs = self.root_sheets.findall(
-                "./sheet[@no={}]/prob[@type={}]"
-                .format(stringToXPath(sheet), stringToXPath(problemtype)))
+        if self.store is not None and not self.pending:
+            return self.store.total_points(problemtype, sheet)
         total = 0.0
-        for prob in probs:
-            if prob.text:
-                total += float(prob.text)
+        for (sheet_no, prob_no), (prob_type, points) in self.probs.items():
+            if sheet_no == sheet and prob_type == problemtype:
+                total += points
         return total
 
     def get_points_of_stud(self, stud):
@@ -473,87 +1696,258 @@ class CraftyTutor(cmd.Cmd):
 
         Return both written and voted scores.
         """
-        total_w = 0.0
-        total_v = 0.0
-        # iterate over all problems
-        sheets = stud.findall('sheet')
-        for sheet in sheets:
-            sheet_no = sheet.attrib['no']
-            probs = sheet.findall('prob')
-            for prob in probs:
-                prob_no = prob.attrib['no']
-                # get type
-                prob_type = self.root_sheets.find(
-                        "./sheet[@no={}]/prob[@no={}]"
-                        .format(stringToXPath(sheet_no),
-                                stringToXPath(prob_no))).attrib['type']
-                # sum up
-                if not prob.text:
-                    continue
-                score = float(prob.text)
-                if prob_type == 'w':
-                    total_w += score
-                elif prob_type == 'v':
-                    total_v += score
-        # return total scores
-        return total_w, total_v
-
-    def print_table(self, sheet):
-        """Create the LaTeX file."""
+        self.load_scores()
+        row = self.score_rows[self.stud_rows[stud]]
+        return (sum(itertools.compress(row, self.mask_w)),
+                sum(itertools.compress(row, self.mask_v)))
+
+    def get_points_of_studs(self):
+        """Count the total points of all students in order.
+
+        Return a list of written and voted scores. With a database
+        without unsaved changes, this is a single query.
+        """
+        if self.store is not None and not self.pending:
+            return self.store.student_totals(self.groupname)
+        self.load_scores()
+        mask_w = self.mask_w
+        mask_v = self.mask_v
+        compress = itertools.compress
+        return [(sum(compress(row, mask_w)), sum(compress(row, mask_v)))
+                for row in self.score_rows]
+
+    def get_averages(self):
+        """Average score of each problem over the students who got one.
+
+        Return a list in the order of the matrix columns, None for
+        problems without any score.
+        """
+        self.load_scores()
+        sums = map(math.fsum, zip(*self.score_rows))
+        counts = map(sum, zip(*self.scored_rows))
+        averages = [total / count if count else None
+                    for total, count in zip(sums, counts)]
+        if not self.score_rows:
+            averages = [None] * len(self.col_types)
+        return averages
+
+    def print_averages(self, sheet):
+        """Print the average score of each problem of a sheet."""
+        cursheet = self.get_sheet(sheet)
+        if not cursheet:
+            return
+        averages = self.get_averages()
+        for prob in cursheet.probs:
+            prob_no = prob.no
+            col = self.prob_cols[(sheet, prob_no)]
+            average = averages[col]
+            print("Problem {}({}): {} of {:.6g}".format(
+                prob_no, self.col_types[col],
+                "-" if average is None else "{:.2f}".format(average),
+                self.col_points[col]))
+
+    def ranking(self, count):
+        """Select the best and the worst students by the percentage of
+        all points.
+
+        Return two lists of (student, percent written, percent vote,
+        percent of all points), best first and worst first.
+        """
+        total_written = self.get_total_points('w')
+        total_vote = self.get_total_points('v')
+        standings = [
+            (stud, percentage(written, total_written),
+             percentage(vote, total_vote),
+             percentage(written + vote, total_written + total_vote))
+            for stud, (written, vote) in zip(self.group.students,
+                                             self.get_points_of_studs())]
+        key = operator.itemgetter(3)
+        return (heapq.nlargest(count, standings, key),
+                heapq.nsmallest(count, standings, key))
+
+    def distributions(self):
+        """Collect the distributions of the totals of each problem type
+        over all students and of each sheet over the students with a
+        score for it.
+
+        Return two lists of (label, Distribution, maximum points), for
+        the problem types and for the sheets.
+        """
+        self.load_scores()
+        types = []
+        for problemtype, label, mask in (('w', "Written", self.mask_w),
+                                         ('v', "Vote", self.mask_v)):
+            dist = Distribution()
+            for row in self.score_rows:
+                dist.add(sum(itertools.compress(row, mask)))
+            types.append((label, dist, self.get_total_points(problemtype)))
+        sheets = []
+        for sheet in self.sheet_list:
+            cols = {self.prob_cols[(sheet.no, prob.no)]
+                    for prob in sheet.probs}
+            if not cols:
+                continue
+            dist = Distribution()
+            # the columns of a sheet are usually adjacent
+            if max(cols) - min(cols) + 1 == len(cols):
+                select = operator.itemgetter(slice(min(cols), max(cols) + 1))
+            else:
+                mask = bytes(col in cols for col in range(len(self.col_types)))
+                select = lambda row: list(itertools.compress(row, mask))
+            for row, scored in zip(self.score_rows, self.scored_rows):
+                if any(select(scored)):
+                    dist.add(sum(select(row)))
+            sheets.append(("Sheet " + sheet.no, dist,
+                           sum(self.col_points[col] for col in cols)))
+        return types, sheets
+
+    def print_ranking(self, count):
+        """Print the best and worst students and the score distributions."""
+        if not self.group.students:
+            print("No students.")
+            return
+        best, worst = self.ranking(count)
+        for title, standings in (("Best", best), ("Worst", worst)):
+            print("{} {}:".format(title, len(standings)))
+            for stud, perc_w, perc_v, perc in standings:
+                print("  {:5.1f}% (written {:5.1f}%, vote {:5.1f}%) {}".format(
+                    perc, perc_w, perc_v, as_text(stud.name)))
+        types, sheets = self.distributions()
+        for label, dist, maximum in types + sheets:
+            if not dist.count:
+                print("{}: no scores".format(label))
+                continue
+            print("{}: {} students, mean {:.2f}, sd {:.2f}, quartiles "
+                  "{:g} / {:g} / {:g} of {:g}".format(
+                      label, dist.count, dist.mean, dist.variance() ** 0.5,
+                      dist.percentile(25), dist.percentile(50),
+                      dist.percentile(75), maximum))
+        # histograms only for the totals, one per sheet is too much
+        for label, dist, maximum in types:
+            print("{} points:".format(label))
+            bins = dist.histogram(maximum, RANK_BINS)
+            largest = max(bins)
+            for i, n in enumerate(bins):
+                print("  {:3d}-{:3d}% {:6d} {}".format(
+                    100 * i // RANK_BINS, 100 * (i + 1) // RANK_BINS, n,
+                    "#" * (40 * n // largest if largest else 0)))
+
+    def export_rows(self):
+        """Generate the standings of all students, one dict per student.
+
+        Besides name, id and board count it holds the total written and
+        vote points, their percentage of all points and the score of
+        every problem, named <sheet>/<problem> and None if missing.
+        """
+        total_written = self.get_total_points('w')
+        total_vote = self.get_total_points('v')
+        columns = ["{}/{}".format(*key)
+                   for key in sorted(self.prob_cols, key=self.prob_cols.get)]
+        for stud, (written, vote) in zip(self.group.students,
+                                         self.get_points_of_studs()):
+            row = self.stud_rows[stud]
+            record = {
+                'name': as_text(stud.name),
+                'id': as_text(stud.id),
+                'board': as_text(stud.board),
+                'written': written,
+                'vote': vote,
+                'percent_written': percentage(written, total_written),
+                'percent_vote': percentage(vote, total_vote),
+            }
+            record.update(zip(columns, [
+                score if scored else None for score, scored
+                in zip(self.score_rows[row], self.scored_rows[row])]))
+            yield record
+
+    def export(self, fmt, filename):
+        """Write the standings of all students row by row.
+
+        @fmt: key of EXPORT_FORMATS
+        @filename: output file, '-' for stdout
+
+        Return whether the standings were written.
+        """
+        if filename == '-':
+            EXPORT_FORMATS[fmt](self.export_rows(), sys.stdout)
+            return True
+        try:
+            with open(filename, 'w', newline='') as fout:
+                EXPORT_FORMATS[fmt](self.export_rows(), fout)
+        except OSError as e:
+            print("Cannot write {}: {}".format(filename, e.strerror))
+            return False
+        counters['file writes'] += 1
+        return True
+
+    def print_table(self, sheet, style='extable'):
+        """Create the file with the table of a sheet.
+
+        The file is only rewritten if its content changed, see the
+        manifest. Return its filename or None if there is no table.
+
+        @style: key of TABLE_STYLES
+        """
         # get current sheet
-        xsheet = self.get_sheet(sheet)
-        if not xsheet:
+        cursheet = self.get_sheet(sheet)
+        if not cursheet:
             return
         # what shoud be added to the table?
-        print_id = ask_yes_no("Add students ID (Matrikelnummer)?", 'no')
-        print_percent = ask_yes_no("Add score overview?", 'yes')
-        if print_percent:
-            print_cur_w = ask_yes_no(
+        options = {}
+        options['id'] = self.prompt_yes_no('print.id',
+                "Add students ID (Matrikelnummer)?", 'no')
+        options['percent'] = self.prompt_yes_no('print.percent',
+                "Add score overview?", 'yes')
+        if options['percent']:
+            options['current_written'] = self.prompt_yes_no(
+                    'print.current_written',
                     "Include written points of current sheet?", 'yes')
-            print_cur_v = ask_yes_no(
+            options['current_vote'] = self.prompt_yes_no(
+                    'print.current_vote',
                     "Include vote points of current sheet?", 'no')
+        table = self.get_table(cursheet, options)
+        filename = self.output_filename(TABLE_STYLES[style]['filename'],
+                                        sheet)
+        digest = content_hash([style, table])
+        if self.is_up_to_date(filename, digest):
+            print("{} is up to date.".format(filename))
+            return filename
+        with open(filename, 'w') as ftable:
+            ftable.write(render_table(TABLE_STYLES[style], table))
+        counters['file writes'] += 1
+        self.update_manifest(filename, {'kind': 'table', 'hash': digest,
+                                        'sheet': sheet, 'options': options,
+                                        'style': style})
+        return filename
+
+    def get_table(self, cursheet, options):
+        """Collect all data shown in the table of a sheet.
+
+        @cursheet: the sheet
+        @options: dict of the options asked by print_table
+        """
+        sheet = cursheet.no
         total_written = self.get_total_points('w')
         total_vote = self.get_total_points('v')
-        if print_percent and not print_cur_w:
+        if options['percent'] and not options['current_written']:
             total_written -= self.get_points(sheet, 'w')
-        if print_percent and not print_cur_v:
+        if options['percent'] and not options['current_vote']:
             total_vote -= self.get_points(sheet, 'v')
-        # get titles
-        title = self.root_group.find('title').text
-        subtitle = self.root_group.find('subtitle').text
-        # open file
-        filename = "{}_sheet{}.tex".format(self.groupfile.replace(".xml", ""),
-                sheet)
-        ftable = open(filename, 'w')
-
-        # write header
-        ftable.write("\\documentclass[%\n  ")
-        if not print_id:
-            ftable.write("%")
-        ftable.write("matrikelnummer,\n  ")
-        if not print_percent:
-            ftable.write("%")
-        ftable.write("punktestand\n]{exTable}\n\n")
-        # write body
-        ftable.write("\\begin{document}\n\n")
-        ftable.write("\\exTitle({})\n\\exSubtitle({}{})\n\n".format(
-            title, subtitle, sheet))
-        ftable.write("\\setHandInPoints({:.6g})\n\\setVotePoints({:.6g})\n"
-                .format(total_written, total_vote))
-        # write problems
-        for prob in xsheet.findall('prob'):
-            ftable.write("\\addProblem(A{})({})\n".format(
-                prob.attrib['no'], prob.attrib['type']))
-        # write students
-        for stud in self.root_group.findall('student'):
-            # general info
-            ftable.write("\\addStudent({})({})({})".format(
-                text_or_none(stud.find('name')),
-                text_or_none(stud.find('id')),
-                text_or_none(stud.find('board')))
-                )
+        prob_numbers = [prob.no for prob in cursheet.probs]
+        table = {
+            'sheet': sheet,
+            'options': options,
+            'title': self.group.title,
+            'subtitle': self.group.subtitle,
+            'total_written': total_written,
+            'total_vote': total_vote,
+            'problems': [(prob_no, self.probs[(sheet, prob_no)][0])
+                         for prob_no in prob_numbers],
+            'students': [],
+        }
+        studs_scores = self.get_points_of_studs()
+        for stud, scores in zip(self.group.students, studs_scores):
             # percentage of score
-            scores = self.get_points_of_stud(stud)
             try:
                 perc_w = 100.*scores[0]/total_written
             except ZeroDivisionError:
@@ -562,57 +1956,183 @@ class CraftyTutor(cmd.Cmd):
                 perc_v = 100.*scores[1]/total_vote
             except ZeroDivisionError:
                 perc_v = 0.
-            ftable.write("({:.2f})({:.2f})".format(perc_v, perc_w))
             # score of current sheet
-            for prob in xsheet.findall('prob'):
-                ftable.write("({})".format(
-                    text_or_none(
-                        stud.find("./sheet[@no={}]/prob[@no={}]"
-                                  .format(stringToXPath(sheet),
-                                          stringToXPath(prob.attrib['no'])))
-                        )))
-            ftable.write("\n")
-        # finish
-        ftable.write("\n\\makeTable\n\n\\end{document}")
-        # close file
-        ftable.close()
+            stud_scores = stud.sheets.get(sheet, {})
+            cells = []
+            for prob_no in prob_numbers:
+                score = stud_scores.get(prob_no)
+                cells.append("" if score is None else as_text(score.text))
+            table['students'].append((
+                as_text(stud.name), as_text(stud.id), as_text(stud.board),
+                perc_v, perc_w, cells))
+        return table
 
     def print_scheine(self):
-        "Print LaTeX file for the Scheine"
-        filename = "scheine_{}.tex".format(self.groupfile.replace(".xml", ""))
-        fscheine = open(filename, 'w')
-        print("Does ... get a Schein?")
-        for stud in self.root_group.findall('student'):
-            stud_name = stud.find('name').text
-            stud_id = stud.find('id').text
-            is_passed = ask_yes_no("{}?".format(stud_name), 'yes')
+        """Print LaTeX file for the Scheine
+
+        Who gets a Schein is decided by the rules, see schein_decision,
+        only borderline cases are asked. The answer whether a student is
+        male is remembered in the manifest.
+
+        The file is only rewritten if its content changed, see the
+        manifest.
+        """
+        filename = self.output_filename("scheine_{}.tex")
+        rules = self.schein_rules()
+        known_male = self.load_manifest().get(filename, {}).get('male', {})
+        inputs = self.schein_inputs()
+        scheine = []
+        decisions = collections.Counter()
+        for stud, (name, perc_w, perc_v, board) in zip(self.group.students,
+                                                       inputs):
+            stud_name = stud.name
+            stud_id = stud.id
+            decision = schein_decision(rules, perc_w, perc_v, board)
+            decisions[decision] += 1
+            if decision == 'ask':
+                is_passed = self.prompt_yes_no('scheine.passed.' + stud_name,
+                        "Borderline: {} has {:.1f}% written and {:.1f}% vote "
+                        "points and presented {}. Schein?".format(stud_name,
+                            perc_w, perc_v, as_text(stud.board)), 'no')
+            else:
+                is_passed = decision == 'yes'
             if is_passed:
-                is_male = ask_yes_no("Male?", 'yes')
+                is_male = known_male.get(stud_name)
+                if is_male is None or self.get_answer(
+                        'scheine.male.' + stud_name) is not None:
+                    is_male = self.prompt_yes_no('scheine.male.' + stud_name,
+                            "Is {} male?".format(stud_name), 'yes')
+                    known_male[stud_name] = is_male
+                scheine.append((stud_name, stud_id, is_male))
+        print("{} students get a Schein, {} by the rules, {} were borderline,"
+              " {} do not.".format(len(scheine), decisions['yes'],
+                                   decisions['ask'], decisions['no']))
+        digest = content_hash(scheine)
+        if self.is_up_to_date(filename, digest):
+            print("{} is up to date.".format(filename))
+        else:
+            fscheine = open(filename, 'w')
+            counters['file writes'] += 1
+            for stud_name, stud_id, is_male in scheine:
                 fscheine.write("\\makeschein{}{{{}}}{{{}}}\n".format(
                     "" if is_male else "[f]", stud_name, stud_id))
-        fscheine.close()
+            fscheine.close()
+        # the inputs of the decisions are kept for stale_outputs
+        self.update_manifest(filename, {'kind': 'scheine', 'hash': digest,
+                                        'roster': self.roster_hash(),
+                                        'male': known_male,
+                                        'rules': rules, 'inputs': inputs})
+
+    def schein_inputs(self):
+        """Return the inputs of schein_decision for all students in order,
+        as lists of name, percentage of written and of vote points and
+        board count."""
+        total_written = self.get_total_points('w')
+        total_vote = self.get_total_points('v')
+        return [[as_text(stud.name), percentage(written, total_written),
+                 percentage(vote, total_vote), stud.board]
+                for stud, (written, vote) in zip(self.group.students,
+                                                 self.get_points_of_studs())]
 
+    def schein_rules(self):
+        """Return the thresholds of the Schein rules, see SCHEIN_RULES.
+
+        Each can be changed by the answer 'scheine.<rule>', e.g. with
+        --answer scheine.written=60.
+        """
+        rules = dict(SCHEIN_RULES)
+        for rule in rules:
+            answer = self.answers.get('scheine.' + rule)
+            if answer is None:
+                continue
+            try:
+                rules[rule] = float(answer)
+            except ValueError:
+                print("Ignoring invalid scheine.{} {}.".format(rule, answer))
+        return rules
+
+    ####################################################################
+    # Manifest of the created LaTeX files                              #
+    ####################################################################
+
+    def output_filename(self, pattern, *args):
+        """Return the name of an output file of the group, in the
+        directory of the group file.
+
+        @pattern: format string, the first field is the group filename
+                  without directory and extension
+        """
+        directory, name = os.path.split(self.groupfile.replace(".xml", ""))
+        return os.path.join(directory, pattern.format(name, *args))
+
+    def load_manifest(self):
+        """Return the manifest of the created LaTeX files.
+
+        It maps each filename to a dict with the hash of the data it was
+        created from, its kind ('table' or 'scheine') and what is needed
+        to check it again.
+        """
+        try:
+            with open(self.output_filename("{}.manifest")) as fmanifest:
+                return json.load(fmanifest)
+        except (OSError, ValueError):
+            return {}
+
+    def update_manifest(self, filename, entry):
+        """Store the manifest entry of a created file."""
+        manifest = self.load_manifest()
+        manifest[filename] = entry
+        manifestfile = self.output_filename("{}.manifest")
+        with open(manifestfile + ".tmp", 'w') as fmanifest:
+            json.dump(manifest, fmanifest, indent=1, sort_keys=True)
+        os.replace(manifestfile + ".tmp", manifestfile)
+
+    def is_up_to_date(self, filename, digest):
+        """Check whether a file exists and was created from data with the
+        given hash."""
+        entry = self.load_manifest().get(filename)
+        return (entry is not None and entry['hash'] == digest
+                and os.path.exists(filename))
+
+    def roster_hash(self):
+        """Return the hash of names and ids of all students."""
+        return content_hash([(as_text(stud.name), as_text(stud.id))
+                             for stud in self.group.students])
+
+    def stale_outputs(self):
+        """Return the created files whose data changed since.
+
+        The Scheine are stale if names or ids changed or if the rules
+        decide differently for any student now, the answers to the
+        borderline cases are unknown until asked again.
+        """
+        stale = []
+        for filename, entry in sorted(self.load_manifest().items()):
+            if not os.path.exists(filename):
+                stale.append(filename)
+            elif entry['kind'] == 'table':
+                cursheet = self.sheets.get(entry['sheet'])
+                style = entry.get('style', 'extable')
+                if (cursheet is None or content_hash([style, self.get_table(
+                        cursheet, entry['options'])]) != entry['hash']):
+                    stale.append(filename)
+            elif entry['kind'] == 'scheine':
+                if (self.roster_hash() != entry['roster']
+                        or 'inputs' not in entry
+                        or schein_decisions(entry['rules'], entry['inputs'])
+                        != schein_decisions(self.schein_rules(),
+                                            self.schein_inputs())):
+                    stale.append(filename)
+        return stale
 
 ########################################################################
 # Top-level helper functions                                           #
 ########################################################################
 
-# taken from http://effbot.org/zone/element-lib.htm#prettyprint
-def indent(elem, level=0):
-    """In-place prettyprint formatter."""
-    i = "\n" + level*"  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-        for elem in elem:
-            indent(elem, level+1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+# counts of expensive internal calls, see 'stats'
+counters = collections.Counter()
+
+empty_completer = stringcompleter.StringCompleter([])
 
 
 def input_def(prompt, default):
@@ -652,36 +2172,1052 @@ def ask_yes_no(question, default):
             return False
 
 
-def text_or_none(xmltree):
-    """Return either the text of the xmltree or '' if it is None."""
-    if xmltree is None:
+def as_text(value):
+    """Return value as string or '' if it is None."""
+    if value is None:
         return ""
-    elif xmltree.text is None:
-        return ""
-    else:
-        return xmltree.text
+    return str(value)
+
+
+def describe_record(record):
+    """Return a change record as one line of text."""
+    return " ".join([record[0]] + [json.dumps(arg) for arg in record[1:]])
+
+
+def content_hash(data):
+    """Return a hash of data that can be serialized to JSON."""
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False,
+                                     sort_keys=True)
+                          .encode('utf-8')).hexdigest()
+
+
+def escape_latex(text):
+    """Escape the special characters of LaTeX in text."""
+    return "".join(LATEX_SPECIALS.get(c, c) for c in text)
+
+
+def escape_csv(text):
+    """Quote text as a field of a CSV file if needed."""
+    if any(c in text for c in ',"\r\n'):
+        return '"{}"'.format(text.replace('"', '""'))
+    return text
+
+
+LATEX_SPECIALS = {
+    '\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$',
+    '#': r'\#', '_': r'\_', '{': r'\{', '}': r'\}',
+    '~': r'\textasciitilde{}', '^': r'\textasciicircum{}',
+}
+
+# Templates of the table of a sheet. The header gets the fields title,
+# subtitle, sheet, total_written, total_vote, problems (the problem
+# template of all problems joined), columns (one 'r' per problem),
+# no_id and no_percent ('%' if the option is off, else ''). A row gets
+# name, id, board, perc_v, perc_w and cells (the cell template of all
+# scores joined). Texts are passed through escape first.
+TABLE_STYLES = {
+    'extable': {
+        'filename': "{}_sheet{}.tex",
+        'escape': str,
+        'header': ("\\documentclass[%\n  {no_id}matrikelnummer,\n  "
+                   "{no_percent}punktestand\n]{{exTable}}\n\n"
+                   "\\begin{{document}}\n\n"
+                   "\\exTitle({title})\n\\exSubtitle({subtitle}{sheet})\n\n"
+                   "\\setHandInPoints({total_written:.6g})\n"
+                   "\\setVotePoints({total_vote:.6g})\n{problems}"),
+        'problem': "\\addProblem(A{no})({type})\n",
+        'row': ("\\addStudent({name})({id})({board})"
+                "({perc_v:.2f})({perc_w:.2f}){cells}\n"),
+        'cell': "({})",
+        'footer': "\n\\makeTable\n\n\\end{document}",
+    },
+    'tabular': {
+        'filename': "{}_sheet{}_tabular.tex",
+        'escape': escape_latex,
+        'header': ("% {title} -- {subtitle}{sheet}\n"
+                   "\\begin{{tabular}}{{lllrr{columns}}}\n"
+                   "Name & ID & Board & Vote (\\%) & Written (\\%)"
+                   "{problems} \\\\\n\\hline\n"),
+        'problem': " & A{no}",
+        'row': ("{name} & {id} & {board} & {perc_v:.2f} & {perc_w:.2f}"
+                "{cells} \\\\\n"),
+        'cell': " & {}",
+        'footer': "\\end{tabular}\n",
+    },
+    'csv': {
+        'filename': "{}_sheet{}.csv",
+        'escape': escape_csv,
+        'header': "Name,ID,Board,Vote (%),Written (%){problems}\n",
+        'problem': ",A{no}",
+        'row': "{name},{id},{board},{perc_v:.2f},{perc_w:.2f}{cells}\n",
+        'cell': ",{}",
+        'footer': "",
+    },
+}
+
+
+def render_table(style, table):
+    """Return the text of a table collected by CraftyTutor.get_table.
+
+    @style: dict of templates, see TABLE_STYLES
+    """
+    escape = style['escape']
+    options = table['options']
+    problem = style['problem'].format
+    header = style['header'].format(
+        title=escape(str(table['title'])),
+        subtitle=escape(str(table['subtitle'])),
+        sheet=escape(table['sheet']),
+        total_written=table['total_written'],
+        total_vote=table['total_vote'],
+        problems="".join(problem(no=escape(no), type=escape(prob_type))
+                         for no, prob_type in table['problems']),
+        columns="r" * len(table['problems']),
+        no_id="" if options['id'] else "%",
+        no_percent="" if options['percent'] else "%")
+    row = style['row'].format
+    cell = style['cell'].format
+    lines = [header]
+    lines.extend(
+        row(name=escape(name), id=escape(studid), board=escape(board),
+            perc_v=perc_v, perc_w=perc_w,
+            cells="".join([cell(escape(c)) for c in cells]))
+        for name, studid, board, perc_v, perc_w, cells in table['students'])
+    lines.append(style['footer'])
+    return "".join(lines)
+
+
+def check_model(sheet_list, group, students=None):
+    """Check sheets and group in a single pass each.
+
+    Finds missing or duplicate sheet and problem numbers, invalid
+    problem types and points, missing title or subtitle, missing or
+    duplicate names and ids, invalid board counts, scores of unknown
+    sheets or problems and scores that are no numbers.
+
+    @students: iterable of the students to check instead of those of
+    group, e.g. read one at a time
+
+    Return a list of the problems found.
+    """
+    problems = []
+    probs = set()
+    sheet_nos = set()
+    for sheet in sheet_list:
+        if sheet.no is None:
+            problems.append("Sheet without number.")
+            continue
+        if sheet.no in sheet_nos:
+            problems.append("Sheet {}: duplicate sheet number."
+                            .format(sheet.no))
+        sheet_nos.add(sheet.no)
+        for prob in sheet.probs:
+            if prob.no is None:
+                problems.append("Sheet {}: problem without number."
+                                .format(sheet.no))
+                continue
+            if (sheet.no, prob.no) in probs:
+                problems.append("Sheet {}: duplicate problem {}."
+                                .format(sheet.no, prob.no))
+            probs.add((sheet.no, prob.no))
+            if prob.type not in ('w', 'v'):
+                problems.append("Sheet {}: problem {} has invalid type {}."
+                                .format(sheet.no, prob.no, prob.type))
+            if not is_finite(prob.points):
+                problems.append("Sheet {}: problem {} has invalid points {}."
+                                .format(sheet.no, prob.no, prob.text))
+    if group.title is None:
+        problems.append("Group: missing title.")
+    if group.subtitle is None:
+        problems.append("Group: missing subtitle.")
+    names = set()
+    studids = set()
+    if students is None:
+        students = group.students
+    for stud in students:
+        name = stud.name
+        if not name:
+            problems.append("Student without name.")
+        elif name in names:
+            problems.append("Student {}: duplicate name.".format(name))
+        names.add(name)
+        if stud.id is None:
+            problems.append("Student {}: missing id.".format(name))
+        elif stud.id:
+            if stud.id in studids:
+                problems.append("Student {}: duplicate id {}."
+                                .format(name, stud.id))
+            studids.add(stud.id)
+        if stud.board is None:
+            problems.append("Student {}: missing board count.".format(name))
+        elif not isinstance(stud.board, int):
+            problems.append("Student {}: invalid board count {}."
+                            .format(name, stud.board))
+        for sheet_no, scores in stud.sheets.items():
+            if sheet_no not in sheet_nos:
+                problems.append("Student {}: scores of unknown sheet {}."
+                                .format(name, sheet_no))
+                continue
+            for prob_no, score in scores.items():
+                if (sheet_no, prob_no) not in probs:
+                    problems.append("Student {}: score of unknown problem {} "
+                                    "of sheet {}.".format(name, prob_no,
+                                                          sheet_no))
+                elif score.text and not is_finite(score.value):
+                    problems.append("Student {}: score {} of sheet {} "
+                                    "problem {} is no number.".format(
+                                        name, score.text, sheet_no, prob_no))
+    return problems
+
+
+def is_finite(value):
+    """Check whether a parsed number is given and finite."""
+    return value is not None and math.isfinite(value)
+
+
+def percentage(points, total):
+    """Return points in percent of total, 0 if total is 0."""
+    try:
+        return 100.*points/total
+    except ZeroDivisionError:
+        return 0.
+
+
+class Distribution(object):
+    """Streaming summary of values.
+
+    Count, mean and variance are updated in one pass (Welford). The
+    values are counted too, for exact percentiles and histograms; scores
+    take few distinct values, so this stays small.
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'values')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.values = collections.Counter()
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.values[value] += 1
+
+    def variance(self):
+        """Return the population variance, 0 without values."""
+        return self.m2 / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Return the nearest-rank percentile, None without values."""
+        rank = max(1, math.ceil(percent / 100. * self.count))
+        seen = 0
+        for value in sorted(self.values):
+            seen += self.values[value]
+            if seen >= rank:
+                return value
+        return None
+
+    def histogram(self, maximum, bins):
+        """Return the counts of values in bins equal parts of 0 to
+        maximum, values outside in the first or last bin."""
+        counts = [0] * bins
+        for value, n in self.values.items():
+            i = int(bins * value / maximum) if maximum else 0
+            counts[min(max(i, 0), bins - 1)] += n
+        return counts
+
+
+def write_csv_rows(rows, fout):
+    """Write dicts of equal keys as CSV with a header line."""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    writer = csv.DictWriter(fout, list(first))
+    writer.writeheader()
+    writer.writerow(first)
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_jsonl_rows(rows, fout):
+    """Write dicts as JSON Lines, one object per line."""
+    for row in rows:
+        fout.write(json.dumps(row, ensure_ascii=False))
+        fout.write("\n")
+
+
+EXPORT_FORMATS = {'csv': write_csv_rows, 'jsonl': write_jsonl_rows}
+
+
+# default number of students of 'rank' and bins of its histograms
+RANK_COUNT = 5
+RANK_BINS = 10
+
+
+# thresholds for a Schein: percentages of the written and vote points,
+# number of presented problems, and how many percentage points below a
+# threshold still count as borderline
+SCHEIN_RULES = {'written': 50.0, 'vote': 50.0, 'board': 1, 'margin': 5.0}
+
+
+def schein_decision(rules, perc_written, perc_vote, board):
+    """Decide by the rules whether a student gets a Schein.
+
+    Return 'yes' if all thresholds are met, 'no' if a percentage misses
+    its threshold by the margin or more or too few problems were
+    presented, and 'ask' for the borderline cases in between and invalid
+    board counts.
+    """
+    shortfall = max(rules['written'] - perc_written,
+                    rules['vote'] - perc_vote)
+    if shortfall >= rules['margin']:
+        return 'no'
+    if not isinstance(board, int):
+        return 'ask'
+    if board < rules['board']:
+        return 'no'
+    return 'yes' if shortfall <= 0 else 'ask'
+
+
+def schein_decisions(rules, inputs):
+    """Return the decisions for the inputs of CraftyTutor.schein_inputs."""
+    return [schein_decision(rules, perc_written, perc_vote, board)
+            for name, perc_written, perc_vote, board in inputs]
+
+
+SHEETS_RECORDS = ('sheet', 'unsheet')
+JOURNAL_COMPACT_SIZE = 1 << 20
+
+def append_journal(xmlfile, records):
+    """Append change records to the journal of a xml file.
+
+    The first line of a new journal holds mtime and size of the xml file
+    the changes apply to, each following line one record in JSON.
+    """
+    journalfile = xmlfile + ".journal"
+    lines = [json.dumps(record, ensure_ascii=False) + "\n"
+             for record in records]
+    if not os.path.exists(journalfile):
+        lines.insert(0, json.dumps(file_key(xmlfile)[1:]) + "\n")
+    counters['file writes'] += 1
+    with open(journalfile, 'a', encoding='utf-8') as fjournal:
+        fjournal.writelines(lines)
+        fjournal.flush()
+        os.fsync(fjournal.fileno())
+
+
+def read_journal(xmlfile):
+    """Return the change records of the journal of a xml file.
+
+    A journal written for a different version of the xml file is
+    ignored, as is a line left incomplete by a crash.
+    """
+    journalfile = xmlfile + ".journal"
+    try:
+        with open(journalfile, encoding='utf-8') as fjournal:
+            lines = fjournal.read().splitlines()
+    except FileNotFoundError:
+        return []
+    try:
+        is_current = json.loads(lines[0]) == file_key(xmlfile)[1:]
+    except (IndexError, ValueError):
+        is_current = False
+    if not is_current:
+        print("Ignoring {}, it does not belong to the current {}."
+              .format(journalfile, xmlfile))
+        return []
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            print("Ignoring incomplete change in {}.".format(journalfile))
+            break
+    return records
+
+
+def journal_size(xmlfile):
+    """Return the size of the journal of a xml file in bytes."""
+    try:
+        return os.path.getsize(xmlfile + ".journal")
+    except OSError:
+        return 0
+
+
+def write_autosave(autosavefile, key, records):
+    """Write change records to a recovery file atomically.
+
+    The first line holds the key of the files the changes apply to, each
+    following line one record in JSON like the journal.
+    """
+    tmpfile = autosavefile + ".tmp"
+    counters['file writes'] += 1
+    with open(tmpfile, 'w', encoding='utf-8') as fautosave:
+        fautosave.write(json.dumps(key) + "\n")
+        for record in records:
+            fautosave.write(json.dumps(record, ensure_ascii=False) + "\n")
+        fautosave.flush()
+        os.fsync(fautosave.fileno())
+    os.replace(tmpfile, autosavefile)
+
+
+def read_autosave(autosavefile):
+    """Return the key and the change records of a recovery file."""
+    with open(autosavefile, encoding='utf-8') as fautosave:
+        lines = fautosave.read().splitlines()
+    if not lines:
+        raise ValueError("empty recovery file")
+    return json.loads(lines[0]), [json.loads(line) for line in lines[1:]]
+
+
+AUTOSAVE_CHANGES = 20
+
+WRITE_CHUNK_LINES = 4096
+
+def write_xml(root, filename):
+    """Write a pretty-printed xml tree to file atomically.
+
+    Whitespace between elements is replaced by the indentation.
+    """
+    write_lines(xml_lines(root), filename)
+
+
+def xml_lines(root):
+    """Generate the lines of a pretty-printed xml tree without recursion."""
+    yield "<?xml version='1.0' encoding='utf-8'?>\n"
+    # stack of (element, level, is closing tag)
+    stack = [(root, 0, False)]
+    while stack:
+        elem, level, closing = stack.pop()
+        pad = "  " * level
+        if closing:
+            yield "{}</{}>\n".format(pad, elem.tag)
+            continue
+        if len(elem):
+            yield "{}<{}{}>\n".format(pad, elem.tag,
+                                     xml_attribs(elem.attrib.items()))
+            stack.append((elem, level, True))
+            stack.extend((child, level + 1, False)
+                         for child in reversed(elem))
+        else:
+            yield xml_line(pad, elem.tag, elem.text, elem.attrib.items())
+
+
+def sheets_xml_lines(sheets):
+    """Generate the lines of the XML file of a list of sheets."""
+    yield "<?xml version='1.0' encoding='utf-8'?>\n"
+    if not sheets:
+        yield "<data />\n"
+        return
+    yield "<data>\n"
+    for sheet in sheets:
+        attribs = xml_attribs([('no', sheet.no)]
+                              + list((sheet.attrib or {}).items()))
+        if not sheet.probs and not sheet.extra:
+            yield "  <sheet{} />\n".format(attribs)
+            continue
+        yield "  <sheet{}>\n".format(attribs)
+        for prob in sheet.probs:
+            yield xml_line("    ", 'prob', prob.text,
+                           [('no', prob.no), ('type', prob.type)])
+        for text in sheet.extra or ():
+            yield "    {}\n".format(text)
+        yield "  </sheet>\n"
+    yield "</data>\n"
+
+
+def group_xml_lines(group):
+    """Generate the lines of the XML file of a group.
+
+    The scores of a sheet of a student are joined to a single line.
+    Unknown elements are written after the known ones but before the
+    students and the sheets.
+    """
+    yield "<?xml version='1.0' encoding='utf-8'?>\n"
+    attribs = xml_attribs((group.attrib or {}).items())
+    if (group.title is None and group.subtitle is None and not group.students
+            and not group.extra):
+        yield "<data{} />\n".format(attribs)
+        return
+    yield "<data{}>\n".format(attribs)
+    for tag, text in (('title', group.title), ('subtitle', group.subtitle)):
+        if text is not None:
+            yield xml_line("  ", tag, text)
+    for text in group.extra or ():
+        yield "  {}\n".format(text)
+    for stud in group.students:
+        yield "  <student{}>\n".format(
+                xml_attribs((stud.attrib or {}).items()))
+        for tag, value in (('name', stud.name), ('board', stud.board),
+                           ('id', stud.id)):
+            if value is not None:
+                yield xml_line("    ", tag, str(value))
+        for text in stud.extra or ():
+            yield "    {}\n".format(text)
+        for sheet_no, scores in stud.sheets.items():
+            attribs = xml_attribs([('no', sheet_no)])
+            if not scores:
+                yield "    <sheet{} />\n".format(attribs)
+                continue
+            yield "".join(
+                ["    <sheet{}>\n".format(attribs)]
+                + [xml_line("      ", 'prob', score.text, [('no', prob_no)])
+                   for prob_no, score in scores.items()]
+                + ["    </sheet>\n"])
+        yield "  </student>\n"
+    yield "</data>\n"
+
+
+def xml_line(pad, tag, text, attribs=()):
+    """Return the line of a xml element without children."""
+    if text:
+        return "{}<{}{}>{}</{}>\n".format(pad, tag, xml_attribs(attribs),
+                                         escape_cdata(text), tag)
+    return "{}<{}{} />\n".format(pad, tag, xml_attribs(attribs))
+
+
+def xml_attribs(attribs):
+    """Return the xml attributes of (key, value) pairs, skipping None."""
+    return "".join(' {}="{}"'.format(key, escape_attrib(value))
+                   for key, value in attribs if value is not None)
 
 
-def stringToXPath(s):
-    """Build a sane XPath literal out of a string."""
-    if "'" not in s: return "'{}'".format(s)
-    if '"' not in s: return '"{}"'.format(s)
-    return "operator.concat('{}')".format(s.replace("'", "',\"'\",'"))
+def write_lines(lines, filename):
+    """Write lines to file atomically.
+
+    The lines are written in buffered chunks to a temporary file which
+    is synced and then renamed over filename.
+    """
+    tmpfile = filename + ".tmp"
+    counters['file writes'] += 1
+    with open(tmpfile, 'w', encoding='utf-8') as fout:
+        chunk = list(itertools.islice(lines, WRITE_CHUNK_LINES))
+        while chunk:
+            fout.write("".join(chunk))
+            chunk = list(itertools.islice(lines, WRITE_CHUNK_LINES))
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmpfile, filename)
+
+
+def escape_cdata(text):
+    """Escape the text of a xml element."""
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def escape_attrib(text):
+    """Escape the value of a xml attribute."""
+    text = escape_cdata(text)
+    if '"' in text:
+        text = text.replace('"', "&quot;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    return text
+
+
+def file_key(filename):
+    """Return path, mtime and size of a file to detect changes."""
+    st = os.stat(filename)
+    return [os.path.abspath(filename), st.st_mtime_ns, st.st_size]
+
+
+def file_hash(filename):
+    """Return the SHA-256 of the content of a file or None if missing."""
+    digest = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def backup(filename):
+    """Copy a file to <filename>.old unless that is already up to date."""
+    backupfile = filename + ".old"
+    st = os.stat(filename)
+    try:
+        st_old = os.stat(backupfile)
+        if (st_old.st_mtime_ns, st_old.st_size) == (st.st_mtime_ns,
+                                                     st.st_size):
+            return
+    except OSError:
+        pass
+    shutil.copy2(filename, backupfile)
+
+
+SNAPSHOT_VERSION = 3
+
+def parse_xml(filename):
+    """Parse a XML file into a xml tree."""
+    with gc_paused():
+        return ET.parse(filename)
+
+
+def load_xml(filename, kind):
+    """Load the sheets or the group of a XML file.
+
+    @kind: key of MODEL_KINDS, 'sheets' or 'group'
+
+    The snapshot <filename>.snapshot stores the loaded data in a flat
+    marshal format together with path, mtime and size of the XML file.
+    If it is missing or stale, the XML file is parsed and the snapshot
+    rewritten.
+    """
+    with gc_paused():
+        return _load_xml(filename, kind)
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Switch off the cyclic garbage collector for a while.
+
+    Building many small objects triggers it over and over without it
+    finding anything to collect.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _load_xml(filename, kind):
+    """Implement load_xml with the garbage collector switched off."""
+    from_xml, flatten, unflatten = MODEL_KINDS[kind]
+    key = [SNAPSHOT_VERSION, kind] + file_key(filename)
+    snapshotfile = filename + ".snapshot"
+    try:
+        with open(snapshotfile, 'rb') as fsnap:
+            snapshot = marshal.loads(fsnap.read())
+        if snapshot[0] == key:
+            counters['snapshot hits'] += 1
+            return unflatten(snapshot[1])
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        pass
+    counters['snapshot misses'] += 1
+    data = from_xml(ET.parse(filename).getroot())
+    try:
+        tmpfile = snapshotfile + ".tmp"
+        counters['file writes'] += 1
+        with open(tmpfile, 'wb') as fsnap:
+            fsnap.write(marshal.dumps([key, flatten(data)]))
+        os.replace(tmpfile, snapshotfile)
+    except OSError:
+        pass
+    return data
+
+
+def load_group_lazy(filename):
+    """Load title, subtitle and students of a group file without scores."""
+    group = tutormodel.Group()
+    for tag, value in iterparse_students(filename, set()):
+        if tag == 'student':
+            group.students.append(value)
+        else:
+            setattr(group, tag, value)
+    return group
+
+
+def iterparse_students(filename, sheet_nos):
+    """Read the students of a group file one at a time.
+
+    Generate ('student', student) for each student, (tag, text) for
+    title and subtitle and ('attrib', attributes) and ('extra', xml
+    texts) for the unknown attributes and elements of the root, see
+    tutormodel.Group. Every student is dropped from the xml tree once
+    it is read.
+
+    @sheet_nos: only read the scores of these sheets, None for all
+    """
+    counters['iterparse passes'] += 1
+    context = ET.iterparse(filename, events=('start', 'end'))
+    event, root = next(context)
+    if root.attrib:
+        yield 'attrib', dict(root.attrib)
+    extra = []
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth:
+            continue
+        if elem.tag == 'student':
+            yield 'student', tutormodel.student_from_xml(elem, sheet_nos)
+            root.clear()
+        elif elem.tag in ('title', 'subtitle'):
+            yield elem.tag, elem.text or ""
+        else:
+            extra.append(tutormodel.xml_text(elem))
+    if extra:
+        yield 'extra', extra
+
+
+MODEL_KINDS = {
+    'sheets': (tutormodel.sheets_from_xml, tutormodel.flatten_sheets,
+               tutormodel.unflatten_sheets),
+    'group': (tutormodel.group_from_xml, tutormodel.flatten_group,
+              tutormodel.unflatten_group),
+}
+
+
+def print_all_tables(sheetsfile, groupfiles, sheets, answers, jobs=None,
+                     style='extable'):
+    """Create the LaTeX tables of many groups in parallel.
+
+    The sheets file is loaded once and handed to a pool of worker
+    processes, each rendering the tables of one group at a time.
+
+    @sheetsfile: filename of the XML file of the sheets
+    @groupfiles: filenames of the XML files of the groups
+    @sheets: list of sheet numbers or None for all sheets
+    @answers: answers to the prompts of print_table
+    @jobs: number of worker processes, default is the number of CPUs
+    @style: key of TABLE_STYLES
+
+    Return the number of groups that failed.
+    """
+    sheet_list = load_xml(sheetsfile, 'sheets')
+    if journal_size(sheetsfile):
+        print("Warning: {}.journal is ignored, use 'compact' first."
+              .format(sheetsfile))
+    if sheets is None:
+        sheets = [sheet.no for sheet in sheet_list]
+    flat_sheets = tutormodel.flatten_sheets(sheet_list)
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_table_worker,
+            initargs=(sheetsfile, flat_sheets)) as pool:
+        futures = {pool.submit(render_group_tables, groupfile, sheets,
+                               answers, style): groupfile
+                   for groupfile in groupfiles}
+        for future in concurrent.futures.as_completed(futures):
+            groupfile = futures[future]
+            try:
+                filenames, output = future.result()
+            except Exception as e:
+                failures.append((groupfile, "{}: {}".format(
+                    type(e).__name__, e)))
+                continue
+            missing = [sheet for sheet, filename in zip(sheets, filenames)
+                       if filename is None]
+            if missing:
+                failures.append((groupfile, "no table for sheet {}: {}"
+                                 .format(", ".join(missing), output.strip())))
+            else:
+                print("{}: {} tables".format(groupfile, len(filenames)))
+    if failures:
+        print("\n{} of {} groups failed:".format(len(failures),
+                                                 len(groupfiles)))
+        for groupfile, msg in sorted(failures):
+            print("  {}: {}".format(groupfile, msg))
+    return len(failures)
+
+
+# sheets shared by all groups rendered in a worker process
+table_worker_sheets = {}
+
+def init_table_worker(sheetsfile, flat_sheets):
+    """Rebuild the sheets once per worker process."""
+    table_worker_sheets['file'] = sheetsfile
+    table_worker_sheets['sheets'] = tutormodel.unflatten_sheets(flat_sheets)
+
+
+def render_group_tables(groupfile, sheets, answers, style):
+    """Create the tables of some sheets of a group in a worker process.
+
+    Return the filenames of the tables (None where it failed) and the
+    text printed meanwhile.
+    """
+    if not os.path.exists(groupfile):
+        raise FileNotFoundError("no such file")
+    # the tables show saved scores only, unsaved ones are never recovered
+    answers = {key: value for key, value in answers.items()
+               if key not in ('autosave', 'autosave.recover')}
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        ct = CraftyTutor(table_worker_sheets['file'], groupfile,
+                         answers=answers, batch=True,
+                         shared_sheets=table_worker_sheets['sheets'])
+        filenames = [ct.print_table(sheet, style) for sheet in sheets]
+    return filenames, output.getvalue()
+
+
+class TutorDaemon(object):
+    """Sheets and groups held once for the CraftyTutor clients of a
+    Unix socket, see serve.
+
+    Each group is a CraftyTutor session sharing the sheets. Changes are
+    applied one at a time in the order they arrive and kept in a log,
+    from which every client gets the changes of the others.
+    """
+
+    def __init__(self, sheets, groups, journal=False, answers=None,
+                 autosave=0):
+        self.sheetsfile = os.path.abspath(sheets)
+        self.sessions = {}
+        shared_sheets = None
+        for group in groups:
+            session = CraftyTutor(sheets, group, journal, answers=answers,
+                                  batch=True, shared_sheets=shared_sheets,
+                                  autosave=autosave)
+            shared_sheets = session.sheet_list
+            self.sessions[os.path.abspath(group)] = session
+        # entries (number, client, group, record) not seen by all clients
+        self.log = collections.deque()
+        self.seq = 0
+        # group and number of the last seen entry of the clients
+        self.clients = {}
+
+    def dispatch(self, client, request):
+        """Answer a request of a client, see tutordaemon.DaemonServer."""
+        if request is None:
+            self.clients.pop(client, None)
+            self.trim_log()
+            return None
+        op = request.get('op')
+        if op == 'hello':
+            return {'sheets': self.sheetsfile, 'groups': list(self.sessions)}
+        if op == 'open':
+            session = self.sessions.get(request.get('group'))
+            if session is None:
+                return {'error': "unknown group"}
+            self.clients[client] = [request['group'], self.seq]
+            return {'sheets': tutormodel.flatten_sheets(session.sheet_list),
+                    'group': tutormodel.flatten_group(session.group)}
+        if op == 'sync' and client in self.clients:
+            return self.sync(client, request.get('record'))
+        if op == 'write':
+            saved = 0
+            for session in self.sessions.values():
+                if session.pending:
+                    saved += len(session.pending)
+                    session.do_write(None)
+            return {'saved': saved}
+        return {'error': "invalid request"}
+
+    def sync(self, client, record):
+        """Apply a change record of a client and return the changes of
+        its group and the sheets the client has not seen yet.
+
+        The inverse of the record is computed here, as the data of the
+        client may miss changes of other tutors. Records that do not fit
+        the data, e.g. removing a student added before another one, are
+        rejected and not logged.
+        """
+        group, seen = self.clients[client]
+        inverse = None
+        if record is not None:
+            session = self.sessions[group]
+            try:
+                inverse = session.inverse(record)
+                session.apply(record)
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                return {'error': repr(e)}
+            session.add_pending(record)
+            if record[0] in SHEETS_RECORDS:
+                for other in self.sessions.values():
+                    if other is not session:
+                        other.update_probs()
+                        other.update_names()
+            self.seq += 1
+            self.log.append((self.seq, client, group, record))
+        changes = [[other == client, change]
+                   for no, other, other_group, change in self.log
+                   if no > seen and (other_group == group
+                                     or change[0] in SHEETS_RECORDS)]
+        self.clients[client][1] = self.seq
+        self.trim_log()
+        return {'changes': changes, 'inverse': inverse}
+
+    def trim_log(self):
+        """Drop the log entries seen by all clients."""
+        seen = min((seq for group, seq in self.clients.values()),
+                   default=self.seq)
+        while self.log and self.log[0][0] <= seen:
+            self.log.popleft()
+
+    def close(self):
+        """Save the pending changes of all groups."""
+        for session in self.sessions.values():
+            if session.pending:
+                session.do_write(None)
+            session.stop_autosave()
+
+
+def serve(path, sheets, groups, journal=False, answers=None, autosave=0):
+    """Serve sheets and groups to CraftyTutor clients on the Unix socket
+    path until interrupted, then save all changes.
+
+    Return False if another daemon uses the socket.
+    """
+    if tutordaemon.is_running(path):
+        print("Another daemon is serving on {}.".format(path))
+        return False
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+    daemon = TutorDaemon(sheets, groups, journal, answers, autosave)
+    server = tutordaemon.DaemonServer(path, daemon.dispatch)
+    print("Serving {} groups on {}.".format(len(groups), path))
+    # stop like on Ctrl-C when terminated
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        with server.lock:
+            daemon.close()
+    return True
+
+
+def read_answers(config, answer_args):
+    """Collect the answers to prompts.
+
+    @config: filename of an INI file with a section [answers] or None
+    @answer_args: list of 'key=value' strings, these take precedence
+    """
+    answers = {}
+    if config:
+        parser = configparser.ConfigParser(interpolation=None)
+        # keys contain student names, keep their case
+        parser.optionxform = str
+        with open(config) as fconfig:
+            parser.read_file(fconfig)
+        if parser.has_section('answers'):
+            answers.update(parser.items('answers'))
+    for arg in answer_args:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            raise ValueError("answer '{}' is not KEY=VALUE".format(arg))
+        answers[key.strip()] = value.strip()
+    return answers
 
 
 def main():
     # parse command line arguments
     parser = argparse.ArgumentParser(description="Manage students scores")
     parser.add_argument('sheets', help="XML file of the problem sheets")
-    parser.add_argument('group', help="XML file of the group")
+    parser.add_argument('group', nargs='+',
+            help="XML file of the group, several only with --tables and "
+                 "--serve")
+    parser.add_argument('--sqlite', metavar='DB',
+            help="store sheets and group in the SQLite database DB, "
+                 "importing the XML files on first use")
+    parser.add_argument('--lazy', action='store_true',
+            help="read the scores of the group file only when a command "
+                 "needs them (not with --sqlite)")
+    parser.add_argument('--autosave', type=float, default=30,
+            metavar='SECONDS', help="save unsaved changes to a recovery "
+            "file at most SECONDS after a change (default: %(default)s, "
+            "0 to switch off)")
+    parser.add_argument('--journal', action='store_true',
+            help="save changes to journal files next to the XML files, "
+                 "merged into them by 'compact' or when they grow large")
+    parser.add_argument('--timing', action='store_true',
+            help="measure time and memory of every command (slower), "
+                 "see 'stats'")
+    parser.add_argument('--stats-file', metavar='FILE',
+            help="write the measurements of 'stats' as JSON to FILE "
+                 "on exit")
+    parser.add_argument('--importscores', nargs=2, metavar=('SHEET', 'FILE'),
+            help="import scores of SHEET from CSV/TSV FILE, save and exit")
+    parser.add_argument('--export', nargs=2, metavar=('FORMAT', 'FILE'),
+            help="write the standings of all students as FORMAT (csv or "
+                 "jsonl) to FILE ('-' for stdout) and exit")
+    parser.add_argument('--tables', metavar='SHEETS',
+            help="create the tables of SHEETS (comma-separated or 'all') "
+                 "for every group in parallel and exit")
+    parser.add_argument('--jobs', type=int,
+            help="number of processes for --tables (default: all CPUs)")
+    parser.add_argument('--table-style', choices=list(TABLE_STYLES),
+            default='extable',
+            help="style of the tables of --tables (default: %(default)s)")
+    parser.add_argument('--serve', metavar='SOCKET',
+            help="hold sheets and groups in a daemon serving CraftyTutors "
+                 "started with --connect on the Unix socket SOCKET")
+    parser.add_argument('--connect', metavar='SOCKET',
+            help="use sheets and group of the daemon on SOCKET instead of "
+                 "the XML files, see --serve")
+    parser.add_argument('--batch', metavar='SCRIPT',
+            help="run the commands of SCRIPT ('-' for stdin) without "
+                 "prompting and exit")
+    parser.add_argument('--answer', action='append', default=[],
+            metavar='KEY=VALUE', help="answer the prompt KEY with VALUE, "
+                                      "may be repeated")
+    parser.add_argument('--config', metavar='FILE',
+            help="read answers to prompts from the [answers] section of "
+                 "the INI file FILE")
     args = parser.parse_args()
+    # choices cannot check only the first of the two values
+    if args.export and args.export[0] not in EXPORT_FORMATS:
+        parser.error("argument --export: invalid FORMAT {!r} (choose from "
+                     "{})".format(args.export[0], ", ".join(
+                         map(repr, EXPORT_FORMATS))))
+    try:
+        answers = read_answers(args.config, args.answer)
+    except (OSError, ValueError, configparser.Error) as e:
+        parser.error(str(e))
+    if args.tables:
+        sheets = None if args.tables == 'all' else args.tables.split(',')
+        sys.exit(1 if print_all_tables(args.sheets, args.group, sheets,
+                                       answers, args.jobs,
+                                       args.table_style) else 0)
+    if args.serve:
+        sys.exit(0 if serve(args.serve, args.sheets, args.group,
+                            args.journal, answers, args.autosave) else 1)
+    if len(args.group) > 1:
+        parser.error("several groups are only supported with --tables "
+                     "and --serve")
+    args.group = args.group[0]
 
     # set readline options
     readline.parse_and_bind('set editing-mode vi')
 
     # fire up the CraftyTutor
-    ct = CraftyTutor(args.sheets, args.group)
-    ct.cmdloop()
+    try:
+        ct = CraftyTutor(args.sheets, args.group, args.journal, args.sqlite,
+                         args.timing or bool(args.stats_file), answers,
+                         bool(args.batch), lazy=args.lazy,
+                         autosave=args.autosave, daemon=args.connect)
+    except (OSError, ValueError) as e:
+        if args.connect:
+            parser.error("cannot use the daemon: {}".format(e))
+        if args.sqlite:
+            parser.error("cannot use the database: {}".format(e))
+        raise
+    if args.importscores:
+        if ct.importscores(*args.importscores):
+            ct.do_write(None)
+    elif args.export:
+        if not ct.export(*args.export):
+            sys.exit(1)
+    elif args.batch == '-':
+        ct.run_script(sys.stdin)
+    elif args.batch:
+        with open(args.batch) as fscript:
+            ct.run_script(fscript)
+    else:
+        ct.cmdloop()
+    if args.stats_file:
+        ct.do_stats(args.stats_file)
 
 
 if __name__ == '__main__':
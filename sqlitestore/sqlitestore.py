@@ -0,0 +1,290 @@
+# SQLite storage of sheets and groups with import/export of the xml trees
+
+import sqlite3
+import xml.etree.ElementTree as ET
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    title TEXT,
+    subtitle TEXT
+);
+CREATE TABLE IF NOT EXISTS students (
+    id INTEGER PRIMARY KEY,
+    grp INTEGER NOT NULL REFERENCES groups(id),
+    pos INTEGER NOT NULL,
+    name TEXT,
+    studid TEXT,
+    board TEXT
+);
+CREATE INDEX IF NOT EXISTS students_name ON students (grp, name);
+CREATE TABLE IF NOT EXISTS sheets (
+    no TEXT PRIMARY KEY,
+    pos INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS problems (
+    sheet TEXT NOT NULL,
+    no TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    type TEXT,
+    points TEXT,
+    PRIMARY KEY (sheet, no)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    student INTEGER NOT NULL REFERENCES students(id),
+    sheet TEXT NOT NULL,
+    prob TEXT NOT NULL,
+    score TEXT,
+    PRIMARY KEY (student, sheet, prob)
+);
+CREATE INDEX IF NOT EXISTS scores_prob ON scores (sheet, prob);
+"""
+
+
+class SQLiteStore(object):
+    """Sheets and any number of groups in one SQLite database.
+
+    Groups are identified by name. Scores are stored as the text entered,
+    so the xml trees can be exported unchanged.
+    """
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    ####################################################################
+    # Import and export of xml trees                                   #
+    ####################################################################
+
+    def has_sheets(self):
+        """Check whether any sheet is stored."""
+        return self.db.execute("SELECT 1 FROM sheets LIMIT 1").fetchone() \
+            is not None
+
+    def has_group(self, group):
+        """Check whether the group is stored."""
+        return self.group_id(group) is not None
+
+    def import_sheets(self, root):
+        """Replace all sheets by those of a xml tree."""
+        with self.db:
+            self.db.execute("DELETE FROM problems")
+            self.db.execute("DELETE FROM sheets")
+            for xsheet in root.findall('sheet'):
+                self.add_sheet(xsheet.attrib['no'],
+                        [(xprob.attrib['no'], xprob.attrib.get('type'),
+                          xprob.text) for xprob in xsheet.findall('prob')])
+
+    def import_group(self, group, root):
+        """Replace a group by the students of a xml tree."""
+        with self.db:
+            grp = self.group_id(group)
+            if grp is not None:
+                self.db.execute("DELETE FROM scores WHERE student IN "
+                                "(SELECT id FROM students WHERE grp = ?)",
+                                (grp,))
+                self.db.execute("DELETE FROM students WHERE grp = ?", (grp,))
+                self.db.execute("DELETE FROM groups WHERE id = ?", (grp,))
+            grp = self.db.execute(
+                    "INSERT INTO groups (name, title, subtitle) "
+                    "VALUES (?, ?, ?)",
+                    (group, xml_text(root.find('title')),
+                     xml_text(root.find('subtitle')))).lastrowid
+            for pos, xstud in enumerate(root.findall('student')):
+                stud = self.db.execute(
+                        "INSERT INTO students (grp, pos, name, studid, board) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (grp, pos, xml_text(xstud.find('name')),
+                         xml_text(xstud.find('id')),
+                         xml_text(xstud.find('board')))).lastrowid
+                self.db.executemany(
+                        "INSERT OR REPLACE INTO scores "
+                        "(student, sheet, prob, score) VALUES (?, ?, ?, ?)",
+                        ((stud, xsheet.attrib['no'], xprob.attrib['no'],
+                          xprob.text)
+                         for xsheet in xstud.findall('sheet')
+                         for xprob in xsheet.findall('prob')))
+
+    def export_sheets(self):
+        """Return the sheets as xml tree."""
+        root = ET.Element('data')
+        xsheet = None
+        for sheet, no, probtype, points in self.db.execute(
+                "SELECT s.no, p.no, p.type, p.points FROM sheets s "
+                "LEFT JOIN problems p ON p.sheet = s.no "
+                "ORDER BY s.pos, p.pos"):
+            if xsheet is None or xsheet.attrib['no'] != sheet:
+                xsheet = ET.SubElement(root, 'sheet', {'no': sheet})
+            if no is not None:
+                xprob = ET.SubElement(xsheet, 'prob',
+                        {'no': no, 'type': probtype})
+                xprob.text = points
+        return root
+
+    def export_group(self, group):
+        """Return a group as xml tree."""
+        root = ET.Element('data')
+        grp = self.group_id(group)
+        if grp is None:
+            return root
+        title, subtitle = self.db.execute(
+                "SELECT title, subtitle FROM groups WHERE id = ?",
+                (grp,)).fetchone()
+        for tag, text in (('title', title), ('subtitle', subtitle)):
+            if text is not None:
+                ET.SubElement(root, tag).text = text
+        students = {}
+        for stud, name, studid, board in self.db.execute(
+                "SELECT id, name, studid, board FROM students "
+                "WHERE grp = ? ORDER BY pos", (grp,)):
+            xstud = ET.SubElement(root, 'student')
+            ET.SubElement(xstud, 'name').text = name
+            ET.SubElement(xstud, 'board').text = board
+            ET.SubElement(xstud, 'id').text = studid or None
+            students[stud] = xstud
+        # scores of all students ordered like the sheets
+        xstud = xsheet = None
+        for stud, sheet, prob, score in self.db.execute(
+                "SELECT sc.student, sc.sheet, sc.prob, sc.score "
+                "FROM scores sc JOIN students st ON st.id = sc.student "
+                "LEFT JOIN sheets s ON s.no = sc.sheet "
+                "LEFT JOIN problems p ON p.sheet = sc.sheet "
+                "AND p.no = sc.prob WHERE st.grp = ? "
+                "ORDER BY st.pos, s.pos, sc.sheet, p.pos", (grp,)):
+            if students[stud] is not xstud \
+                    or xsheet.attrib['no'] != sheet:
+                xstud = students[stud]
+                xsheet = ET.SubElement(xstud, 'sheet', {'no': sheet})
+            ET.SubElement(xsheet, 'prob', {'no': prob}).text = score
+        return root
+
+    ####################################################################
+    # Changes                                                          #
+    ####################################################################
+
+    def apply(self, group, records):
+        """Apply a list of change records in one transaction.
+
+        The records are those of CraftyTutor.mutate.
+        """
+        with self.db:
+            grp = self.group_id(group)
+            if grp is None:
+                grp = self.db.execute("INSERT INTO groups (name) VALUES (?)",
+                                      (group,)).lastrowid
+            for record in records:
+                getattr(self, 'apply_' + record[0])(grp, *record[1:])
+
+    def apply_titles(self, grp, title, subtitle):
+        self.db.execute("UPDATE groups SET title = ?, subtitle = ? "
+                        "WHERE id = ?", (title, subtitle, grp))
+
+    def apply_student(self, grp, name, studid):
+        self.db.execute(
+                "INSERT INTO students (grp, pos, name, studid, board) "
+                "SELECT ?, COALESCE(MAX(pos) + 1, 0), ?, ?, '0' "
+                "FROM students WHERE grp = ?", (grp, name, studid, grp))
+
+    def apply_id(self, grp, name, studid):
+        self.db.execute("UPDATE students SET studid = ? WHERE id = ?",
+                        (studid, self.student_id(grp, name)))
+
+    def apply_board(self, grp, name, board):
+        self.db.execute("UPDATE students SET board = ? WHERE id = ?",
+                        (board, self.student_id(grp, name)))
+
+    def apply_addboard(self, grp, name, count):
+        self.db.execute("UPDATE students SET board = CAST(board AS INTEGER) "
+                        "+ ? WHERE id = ?",
+                        (count, self.student_id(grp, name)))
+
+    def apply_sheet(self, grp, no, probs):
+        self.add_sheet(no, probs)
+
+    def apply_scores(self, grp, name, sheet, scores):
+        stud = self.student_id(grp, name)
+        self.db.executemany(
+                "INSERT OR REPLACE INTO scores (student, sheet, prob, score) "
+                "VALUES (?, ?, ?, ?)",
+                ((stud, sheet, prob, score) for prob, score in scores.items()))
+        # like in the xml tree all problems of the sheet get an entry
+        self.db.execute(
+                "INSERT OR IGNORE INTO scores (student, sheet, prob, score) "
+                "SELECT ?, sheet, no, NULL FROM problems WHERE sheet = ?",
+                (stud, sheet))
+
+    def apply_unstudent(self, grp, name):
+        stud = self.db.execute(
+                "SELECT id FROM students WHERE grp = ? "
+                "ORDER BY pos DESC LIMIT 1", (grp,)).fetchone()[0]
+        self.db.execute("DELETE FROM scores WHERE student = ?", (stud,))
+        self.db.execute("DELETE FROM students WHERE id = ?", (stud,))
+
+    def apply_unsheet(self, grp, no):
+        self.db.execute("DELETE FROM problems WHERE sheet = ?", (no,))
+        self.db.execute("DELETE FROM sheets WHERE no = ?", (no,))
+
+    def apply_unscores(self, grp, name, sheet):
+        self.db.execute("DELETE FROM scores WHERE student = ? AND sheet = ?",
+                        (self.student_id(grp, name), sheet))
+
+    ####################################################################
+    # Queries                                                          #
+    ####################################################################
+
+    def group_id(self, group):
+        row = self.db.execute("SELECT id FROM groups WHERE name = ?",
+                              (group,)).fetchone()
+        return row[0] if row else None
+
+    def student_id(self, grp, name):
+        return self.db.execute(
+                "SELECT id FROM students WHERE grp = ? AND name = ? "
+                "ORDER BY pos LIMIT 1", (grp, name)).fetchone()[0]
+
+    def add_sheet(self, no, probs):
+        """Add a sheet with a list of (number, type, points)."""
+        self.db.execute(
+                "INSERT INTO sheets (no, pos) "
+                "SELECT ?, COALESCE(MAX(pos) + 1, 0) FROM sheets", (no,))
+        self.db.executemany(
+                "INSERT INTO problems (sheet, no, pos, type, points) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((no, probno, pos, probtype, points)
+                 for pos, (probno, probtype, points) in enumerate(probs)))
+
+    def total_points(self, problemtype, sheet=None):
+        """Count the total points of a problem type of all sheets or of
+        a single sheet."""
+        query = ("SELECT COALESCE(SUM(CAST(points AS REAL)), 0.0) "
+                 "FROM problems WHERE type = ?")
+        args = (problemtype,)
+        if sheet is not None:
+            query += " AND sheet = ?"
+            args += (sheet,)
+        return self.db.execute(query, args).fetchone()[0]
+
+    def student_totals(self, group):
+        """Return the written and voted scores of all students of a group
+        in order."""
+        return self.db.execute(
+                "SELECT "
+                "COALESCE(SUM(CASE WHEN p.type = 'w' "
+                "THEN CAST(sc.score AS REAL) END), 0.0), "
+                "COALESCE(SUM(CASE WHEN p.type = 'v' "
+                "THEN CAST(sc.score AS REAL) END), 0.0) "
+                "FROM students st "
+                "LEFT JOIN scores sc ON sc.student = st.id "
+                "LEFT JOIN problems p ON p.sheet = sc.sheet "
+                "AND p.no = sc.prob "
+                "WHERE st.grp = (SELECT id FROM groups WHERE name = ?) "
+                "GROUP BY st.id ORDER BY st.pos", (group,)).fetchall()
+
+
+def xml_text(xmltree):
+    """Return the text of the xmltree or None."""
+    return None if xmltree is None else xmltree.text
@@ -1,25 +1,174 @@
 # http://pymotw.com/2/cmd/
 # https://stackoverflow.com/questions/7821661/how-to-code-autocompletion-in-python
 
+import bisect
+import heapq
 import readline
 
 class StringCompleter(object):
 
-    def __init__(self, options):
+    def __init__(self, options, fuzzy=None):
         self.options = sorted(options)
+        # TrigramIndex for text matching no option
+        self.fuzzy = fuzzy
 
     def complete(self, text, state):
         # build and cache matches
         if state == 0:
             if text:
-                self.matches = [s for s in self.options 
-                        if s and s.startswith(text)]
+                # options starting with text form a slice of the sorted list
+                lo = bisect.bisect_left(self.options, text)
+                hi = lo
+                while (hi < len(self.options)
+                        and self.options[hi].startswith(text)):
+                    hi += 1
+                self.matches = self.options[lo:hi]
+                if not self.matches and self.fuzzy is not None:
+                    self.matches = self.fuzzy.search(text, FUZZY_MATCHES)
             # no text entered, thus all matches
             else:
-                self.matches = self.options[:]
+                self.matches = self.options
         # return match indexed by state
         try: 
             return self.matches[state]
         except IndexError:
             return None
 
+
+class TrigramIndex(object):
+    """Fuzzy lookup of strings by the trigrams they share.
+
+    Strings are compared ignoring case by the Jaccard similarity of their
+    sets of trigrams. Each string has a slot number, and 'postings' maps
+    each trigram to a bit set (an int) of the slots of the strings
+    containing it, so a search counts the shared trigrams of all strings
+    at once with bit operations. 'lengths' maps a number of trigrams to
+    the bit set of the strings with that many.
+    """
+
+    def __init__(self, options=(), threshold=0.3):
+        self.threshold = threshold
+        self.slots = {}
+        self.options = []
+        self.free = []
+        self.postings = {}
+        self.lengths = {}
+        for option in options:
+            self.add(option)
+
+    def add(self, option):
+        if option in self.slots:
+            return
+        if self.free:
+            slot = self.free.pop()
+            self.options[slot] = option
+        else:
+            slot = len(self.options)
+            self.options.append(option)
+        grams = trigrams(option)
+        self.slots[option] = slot
+        bit = 1 << slot
+        self.lengths[len(grams)] = self.lengths.get(len(grams), 0) | bit
+        for gram in grams:
+            self.postings[gram] = self.postings.get(gram, 0) | bit
+
+    def remove(self, option):
+        slot = self.slots.pop(option, None)
+        if slot is None:
+            return
+        self.options[slot] = None
+        self.free.append(slot)
+        bit = 1 << slot
+        grams = trigrams(option)
+        for bitsets, key in [(self.lengths, len(grams))] + [
+                (self.postings, gram) for gram in grams]:
+            bitset = bitsets[key] & ~bit
+            if bitset:
+                bitsets[key] = bitset
+            else:
+                del bitsets[key]
+
+    def retain(self, options):
+        """Remove all strings not in the set options."""
+        for option in [option for option in self.slots
+                       if option not in options]:
+            self.remove(option)
+
+    def search(self, text, limit):
+        """Return up to limit strings similar to text, most similar first.
+
+        The number of trigrams shared with text is summed for all strings
+        in bit planes. Strings are then taken by decreasing number of
+        shared trigrams and, as the similarity only depends on their
+        number of trigrams then, by increasing length, until no string
+        left can rank among the best.
+        """
+        query = trigrams(text)
+        if not query:
+            return []
+        planes = []
+        for gram in query:
+            carry = self.postings.get(gram, 0)
+            for i, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[i], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        lengths = sorted(self.lengths.items())
+        # the best matches so far as heap, the worst first
+        best = []
+        for shared in range(len(query), 0, -1):
+            # a string sharing fewer trigrams has a lower similarity
+            bound = shared / len(query)
+            if bound < self.threshold or (len(best) == limit
+                                          and best[0][0] >= bound):
+                break
+            found = at_least(planes, shared) & ~at_least(planes, shared + 1)
+            for length, bitset in lengths:
+                group = found & bitset
+                if length < shared or not group:
+                    continue
+                similarity = shared / (len(query) + length - shared)
+                if similarity < self.threshold or (len(best) == limit
+                        and similarity <= best[0][0]):
+                    break
+                while group and (len(best) < limit
+                                 or similarity > best[0][0]):
+                    lowest = group & -group
+                    group ^= lowest
+                    option = self.options[lowest.bit_length() - 1]
+                    if len(best) < limit:
+                        heapq.heappush(best, (similarity, option))
+                    else:
+                        heapq.heapreplace(best, (similarity, option))
+        return [option for similarity, option in sorted(best, reverse=True)]
+
+
+def at_least(planes, count):
+    """Return the bit set of the slots whose count, summed in the bit
+    planes (least significant first), is at least count."""
+    if count >> len(planes):
+        return 0
+    greater = 0
+    equal = -1
+    for i in reversed(range(len(planes))):
+        if count >> i & 1:
+            equal &= planes[i]
+        else:
+            greater |= equal & planes[i]
+            equal &= ~planes[i]
+    return greater | equal
+
+
+def trigrams(text):
+    """Return the set of trigrams of text in lower case, padded to weigh
+    its beginning."""
+    if not text:
+        return set()
+    padded = "  " + text.lower() + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# number of fuzzy matches offered
+FUZZY_MATCHES = 5
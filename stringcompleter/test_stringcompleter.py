@@ -0,0 +1,110 @@
+# Tests of the completer and the fuzzy index
+
+import random
+import unittest
+
+from stringcompleter.stringcompleter import (StringCompleter, TrigramIndex,
+                                             at_least, trigrams)
+
+
+def similarity(text, option):
+    """Return the Jaccard similarity of the trigrams, as TrigramIndex."""
+    query = trigrams(text)
+    grams = trigrams(option)
+    return len(query & grams) / len(query | grams)
+
+
+def random_name(rand):
+    return "".join(rand.choice("aeiouklmnrst") for i in
+                   range(rand.randrange(1, 12)))
+
+
+class AtLeastTest(unittest.TestCase):
+
+    def test_counts(self):
+        rand = random.Random(1)
+        counts = [rand.randrange(20) for slot in range(200)]
+        planes = [sum(1 << slot for slot, count in enumerate(counts)
+                      if count >> i & 1)
+                  for i in range(max(counts).bit_length())]
+        for count in range(1, 25):
+            self.assertEqual(
+                    at_least(planes, count),
+                    sum(1 << slot for slot, slot_count in enumerate(counts)
+                        if slot_count >= count), count)
+
+    def test_no_planes(self):
+        self.assertEqual(at_least([], 1), 0)
+
+
+class TrigramIndexTest(unittest.TestCase):
+
+    def check_search(self, index, options, text, limit):
+        """Compare a search with the similarities of all options."""
+        found = index.search(text, limit)
+        expected = sorted((similarity(text, option) for option in options
+                           if similarity(text, option) >= index.threshold),
+                          reverse=True)[:limit]
+        self.assertEqual([similarity(text, option) for option in found],
+                         expected, text)
+        self.assertEqual(len(set(found)), len(found))
+        self.assertTrue(set(found) <= options)
+
+    def test_search(self):
+        rand = random.Random(2)
+        options = {random_name(rand) for i in range(500)}
+        index = TrigramIndex(options)
+        for i in range(200):
+            text = random_name(rand)
+            self.check_search(index, options, text, rand.randrange(1, 8))
+
+    def test_remove_and_reuse(self):
+        rand = random.Random(3)
+        options = {random_name(rand) for i in range(300)}
+        index = TrigramIndex(options)
+        for option in rand.sample(sorted(options), 100):
+            index.remove(option)
+            options.remove(option)
+        for i in range(50):
+            option = random_name(rand)
+            index.add(option)
+            options.add(option)
+        index.retain(set(rand.sample(sorted(options), 150)))
+        options = set(index.slots)
+        self.assertEqual(len(options), 150)
+        for i in range(100):
+            self.check_search(index, options, random_name(rand), 5)
+
+    def test_misspelled(self):
+        index = TrigramIndex(["Anna Berg", "Ben O'Neil", "Cem Yilmaz"])
+        self.assertEqual(index.search("ben oneil", 5)[0], "Ben O'Neil")
+        self.assertEqual(index.search("xyz", 5), [])
+        self.assertEqual(index.search("", 5), [])
+
+
+class StringCompleterTest(unittest.TestCase):
+
+    def matches(self, completer, text):
+        matches = []
+        while True:
+            match = completer.complete(text, len(matches))
+            if match is None:
+                return matches
+            matches.append(match)
+
+    def test_prefix(self):
+        completer = StringCompleter(["Bert", "Anna", "Ben", "Anton"])
+        self.assertEqual(self.matches(completer, "An"), ["Anna", "Anton"])
+        self.assertEqual(self.matches(completer, ""),
+                         ["Anna", "Anton", "Ben", "Bert"])
+        self.assertEqual(self.matches(completer, "Cem"), [])
+
+    def test_fuzzy(self):
+        names = ["Anna Berg", "Ben O'Neil"]
+        completer = StringCompleter(names, TrigramIndex(names))
+        self.assertEqual(self.matches(completer, "ben oneil"),
+                         ["Ben O'Neil"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,796 @@
+# Tests of CraftyTutor
+
+import contextlib
+import csv
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import xml.etree.ElementTree as ET
+
+import craftytutor
+from craftytutor import CraftyTutor
+import tutordaemon.tutordaemon as tutordaemon
+import tutormodel.tutormodel as tutormodel
+
+
+SHEETS_XML = """<?xml version='1.0' encoding='utf-8'?>
+<data>
+  <sheet no="1">
+    <prob no="1" type="w">4</prob>
+    <prob no="2" type="v">4</prob>
+  </sheet>
+  <sheet no="2">
+    <prob no="3" type="w">5.5</prob>
+    <prob no="4" type="v">3</prob>
+  </sheet>
+</data>
+"""
+
+GROUP_XML = """<?xml version='1.0' encoding='utf-8'?>
+<data>
+  <title>Analysis I</title>
+  <subtitle>Blatt &amp; Co</subtitle>
+  <student>
+    <name>Anna Berg</name>
+    <board>2</board>
+    <id>1000</id>
+    <sheet no="1">
+      <prob no="1">3</prob>
+      <prob no="2">4</prob>
+    </sheet>
+    <sheet no="2">
+      <prob no="3">1.5</prob>
+      <prob no="4" />
+    </sheet>
+  </student>
+  <student>
+    <name>Ben O'Neil</name>
+    <board>0</board>
+    <id>1001</id>
+    <sheet no="1">
+      <prob no="1">2</prob>
+      <prob no="2">0</prob>
+    </sheet>
+  </student>
+  <student>
+    <name>Cem &lt;Yilmaz&gt;</name>
+    <board>1</board>
+    <id />
+  </student>
+</data>
+"""
+
+
+def canonical(filename):
+    """Return the XML file without formatting whitespace."""
+    return ET.canonicalize(from_file=filename, strip_text=True)
+
+
+def state(ct):
+    """Return sheets and group of a session as plain data."""
+    ct.load_scores()
+    return (tutormodel.flatten_sheets(ct.sheet_list),
+            tutormodel.flatten_group(ct.group))
+
+
+class TutorTestCase(unittest.TestCase):
+    """Sheets and group files in a temporary directory."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sheetsfile = os.path.join(self.dir, 'sheets.xml')
+        self.groupfile = os.path.join(self.dir, 'group.xml')
+        with open(self.sheetsfile, 'w', encoding='utf-8') as fsheets:
+            fsheets.write(SHEETS_XML)
+        with open(self.groupfile, 'w', encoding='utf-8') as fgroup:
+            fgroup.write(GROUP_XML)
+        self.quiet = contextlib.redirect_stdout(io.StringIO())
+        self.quiet.__enter__()
+
+    def tearDown(self):
+        self.quiet.__exit__(None, None, None)
+        shutil.rmtree(self.dir)
+
+    def tutor(self, **args):
+        return CraftyTutor(self.sheetsfile, self.groupfile, batch=True,
+                           **args)
+
+
+class RoundTripTest(TutorTestCase):
+
+    def test_write_unchanged(self):
+        for kind, filename in (('sheets', self.sheetsfile),
+                               ('group', self.groupfile)):
+            expected = canonical(filename)
+            model = craftytutor.load_xml(filename, kind)
+            lines = (craftytutor.sheets_xml_lines if kind == 'sheets'
+                     else craftytutor.group_xml_lines)(model)
+            craftytutor.write_lines(lines, filename)
+            self.assertEqual(canonical(filename), expected)
+
+    def test_parsed_values(self):
+        ct = self.tutor()
+        self.assertEqual(ct.sheets['2'].probs[0].points, 5.5)
+        anna = ct.students['Anna Berg']
+        self.assertEqual(anna.board, 2)
+        self.assertEqual(anna.sheets['2']['3'].value, 1.5)
+        self.assertIsNone(anna.sheets['2']['4'].value)
+        self.assertEqual(ct.group.subtitle, "Blatt & Co")
+        self.assertEqual(ct.students['Cem <Yilmaz>'].id, "")
+        self.assertEqual(ct.check(), [])
+
+    def test_write_changes(self):
+        ct = self.tutor()
+        ct.mutate('scores', "Ben O'Neil", '2', {'3': '5', '4': '1'})
+        ct.mutate('student', "Dora", '1003')
+        expected = state(ct)
+        ct.do_write(None)
+        self.assertEqual(state(self.tutor()), expected)
+        self.assertEqual(state(self.tutor(lazy=True)), expected)
+
+
+class UnknownContentTest(TutorTestCase):
+    """Elements and attributes the model does not know are kept."""
+
+    def setUp(self):
+        TutorTestCase.setUp(self)
+        with open(self.sheetsfile, 'w', encoding='utf-8') as fsheets:
+            fsheets.write(SHEETS_XML
+                .replace('<sheet no="2">', '<sheet no="2" due="2024-05-01">')
+                .replace('3</prob>', '3</prob>'
+                         '<note lang="de">Bonus <b>2</b></note>'))
+        # unknown elements are written after the known ones
+        with open(self.groupfile, 'w', encoding='utf-8') as fgroup:
+            fgroup.write(GROUP_XML.replace('<data>', '<data term="SS24">')
+                .replace('Co</subtitle>', 'Co</subtitle><tutor>Jo</tutor>')
+                .replace('1001</id>', '1001</id>'
+                         '<email>ben@example.org</email>')
+                .replace('<student>\n    <name>Cem',
+                         '<student room="2">\n    <name>Cem'))
+
+    def check_kept(self):
+        sheets = ET.parse(self.sheetsfile).getroot()
+        self.assertEqual(sheets.find("sheet[@no='2']").get('due'),
+                         "2024-05-01")
+        self.assertEqual(ET.tostring(sheets.find("sheet/note"),
+                                     encoding='unicode').strip(),
+                         '<note lang="de">Bonus <b>2</b></note>')
+        group = ET.parse(self.groupfile).getroot()
+        self.assertEqual(group.get('term'), "SS24")
+        self.assertEqual(group.findtext('tutor'), "Jo")
+        self.assertEqual(group.findtext('student/email'), "ben@example.org")
+        self.assertEqual(group.find("student[name='Cem <Yilmaz>']")
+                         .get('room'), "2")
+
+    def test_write_unchanged(self):
+        for kind, filename in (('sheets', self.sheetsfile),
+                               ('group', self.groupfile)):
+            expected = canonical(filename)
+            model = craftytutor.load_xml(filename, kind)
+            lines = (craftytutor.sheets_xml_lines if kind == 'sheets'
+                     else craftytutor.group_xml_lines)(model)
+            craftytutor.write_lines(lines, filename)
+            self.assertEqual(canonical(filename), expected)
+
+    def test_write_changes(self):
+        for lazy in (False, True):
+            ct = self.tutor(lazy=lazy)
+            ct.mutate('sheet', '3', [['5', 'w', '4']])
+            ct.mutate('scores', "Ben O'Neil", '2', {'3': '5'})
+            ct.do_write(None)
+            self.check_kept()
+        # once more from the snapshots
+        ct = self.tutor()
+        ct.mutate('addboard', "Ben O'Neil", 1)
+        ct.do_write(None)
+        self.check_kept()
+
+
+class BatchTest(TutorTestCase):
+
+    def run_script(self, script, **args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.tutor(**args).run_script(io.StringIO(script))
+        return output.getvalue()
+
+    def test_quit(self):
+        output = self.run_script("check\nquit\ncheck\n")
+        self.assertEqual(output.count("No problems found."), 1)
+
+    def test_quit_not_confirmed(self):
+        output = self.run_script("quit\ncheck\n",
+                                 answers={'quit.confirm': 'no'})
+        self.assertIn("No problems found.", output)
+
+
+class ExportTest(TutorTestCase):
+
+    def test_export(self):
+        filename = os.path.join(self.dir, 'standings.csv')
+        self.assertTrue(self.tutor().export('csv', filename))
+        with open(filename) as fexport:
+            rows = list(csv.reader(fexport))
+        self.assertEqual([row[0] for row in rows[1:]],
+                         ["Anna Berg", "Ben O'Neil", "Cem <Yilmaz>"])
+
+    def test_unwritable_file(self):
+        filename = os.path.join(self.dir, 'missing', 'standings.csv')
+        self.assertFalse(self.tutor().export('csv', filename))
+
+    def test_unknown_format(self):
+        argv = sys.argv
+        sys.argv = ['craftytutor.py', os.path.join(self.dir, 'missing.xml'),
+                    self.groupfile, '--export', 'xml', '-']
+        try:
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit) as raised:
+                    craftytutor.main()
+        finally:
+            sys.argv = argv
+        self.assertEqual(raised.exception.code, 2)
+
+
+class MatrixTest(TutorTestCase):
+
+    def expected_points(self, ct):
+        """Return the totals of all students summed from the model."""
+        types = {(sheet.no, prob.no): prob.type
+                 for sheet in ct.sheet_list for prob in sheet.probs}
+        points = []
+        for stud in ct.group.students:
+            totals = {'w': 0.0, 'v': 0.0}
+            for sheet_no, scores in stud.sheets.items():
+                for prob_no, score in scores.items():
+                    if score.value is not None:
+                        totals[types[(sheet_no, prob_no)]] += score.value
+            points.append((totals['w'], totals['v']))
+        return points
+
+    def test_totals(self):
+        ct = self.tutor()
+        changes = (['sheet', '3', [['5', 'v', '4'], ['6', 'w', '2']]],
+                   ['scores', "Ben O'Neil", '3', {'5': '3', '6': '2'}],
+                   ['scores', "Anna Berg", '1', {'1': 'x'}],
+                   ['student', "Dora", '1003'],
+                   ['scores', "Dora", '3', {'6': '1'}])
+        for change in changes:
+            ct.mutate(*change)
+            self.assertEqual(ct.get_points_of_studs(),
+                             self.expected_points(ct))
+        for change in changes:
+            ct.undo()
+            self.assertEqual(
+                    [ct.get_points_of_stud(stud)
+                     for stud in ct.group.students],
+                    self.expected_points(ct))
+
+
+class RankTest(TutorTestCase):
+
+    def test_distribution(self):
+        rand = random.Random(4)
+        for count in (1, 2, 7, 100):
+            # distinct values, so that each rank has its own value
+            values = [n / 20 for n in rand.sample(range(201), count)]
+            dist = craftytutor.Distribution()
+            for value in values:
+                dist.add(value)
+            self.assertEqual(dist.count, count)
+            self.assertAlmostEqual(dist.mean, statistics.mean(values))
+            self.assertAlmostEqual(dist.variance(),
+                                   statistics.pvariance(values))
+            ordered = sorted(values)
+            for percent in (1, 25, 50, 75, 100):
+                # nearest rank, ceil(percent * count / 100)
+                rank = -(-percent * count // 100)
+                self.assertEqual(dist.percentile(percent),
+                                 ordered[rank - 1], percent)
+            bins = dist.histogram(10, 4)
+            self.assertEqual(sum(bins), count)
+            self.assertEqual(bins[3], sum(value >= 7.5 for value in values))
+
+    def test_no_values(self):
+        dist = craftytutor.Distribution()
+        self.assertEqual(dist.variance(), 0.0)
+        self.assertIsNone(dist.percentile(50))
+        self.assertEqual(dist.histogram(10, 3), [0, 0, 0])
+
+    def test_ranking(self):
+        for lazy in (False, True):
+            ct = self.tutor(lazy=lazy)
+            best, worst = ct.ranking(2)
+            self.assertEqual([stud.name for stud, *percents in best],
+                             ["Anna Berg", "Ben O'Neil"])
+            self.assertEqual([stud.name for stud, *percents in worst],
+                             ["Cem <Yilmaz>", "Ben O'Neil"])
+            self.assertAlmostEqual(best[0][3], 100 * 8.5 / 16.5)
+            types, sheets = ct.distributions()
+            self.assertEqual([(label, dict(dist.values), maximum)
+                              for label, dist, maximum in types],
+                             [("Written", {4.5: 1, 2: 1, 0: 1}, 9.5),
+                              ("Vote", {4: 1, 0: 2}, 7)])
+            # only the students with scores of a sheet
+            self.assertEqual([(label, dict(dist.values), maximum)
+                              for label, dist, maximum in sheets],
+                             [("Sheet 1", {7: 1, 2: 1}, 8),
+                              ("Sheet 2", {1.5: 1}, 8.5)])
+
+
+class CountersTest(TutorTestCase):
+
+    def count(self, func):
+        """Return the counters increased by calling func."""
+        before = craftytutor.counters.copy()
+        func()
+        return craftytutor.counters - before
+
+    def test_snapshots(self):
+        self.assertEqual(self.count(self.tutor)['snapshot misses'], 2)
+        counts = self.count(self.tutor)
+        self.assertEqual(counts['snapshot hits'], 2)
+        self.assertEqual(counts['snapshot misses'], 0)
+        self.assertEqual(counts['index rebuilds'], 1)
+
+    def test_lazy_passes(self):
+        ct = self.tutor(lazy=True)
+        counts = self.count(lambda: ct.load_scores('1'))
+        self.assertEqual(counts['iterparse passes'], 1)
+        self.assertEqual(counts['score row updates'], 2)
+        self.assertEqual(self.count(lambda: ct.load_scores('1')), {})
+
+
+class LazyTest(TutorTestCase):
+
+    def test_load_scores(self):
+        ct = self.tutor(lazy=True)
+        anna = ct.students['Anna Berg']
+        # no scores read by the check at startup
+        self.assertFalse(ct.all_loaded)
+        self.assertEqual(anna.sheets, {})
+        ct.load_scores('2')
+        self.assertEqual(ct.loaded_sheets, {'2'})
+        self.assertEqual(list(anna.sheets), ['2'])
+        self.assertEqual(ct.students["Ben O'Neil"].sheets, {})
+        # changed scores are kept when reading the others
+        ct.mutate('scores', "Anna Berg", '2', {'3': '5'})
+        ct.load_scores()
+        self.assertTrue(ct.all_loaded)
+        self.assertEqual(anna.sheets['1']['1'].value, 3)
+        self.assertEqual(anna.sheets['2']['3'].value, 5)
+        self.assertEqual(ct.students["Ben O'Neil"].sheets['1']['1'].value, 2)
+
+    def test_check(self):
+        with open(self.groupfile, 'w', encoding='utf-8') as fgroup:
+            fgroup.write(GROUP_XML.replace('<prob no="2">0</prob>',
+                                           '<prob no="2">x</prob>'))
+        problem = "Student Ben O'Neil: score x of sheet 1 problem 2 " \
+                  "is no number."
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            ct = self.tutor(lazy=True)
+        self.assertIn("Found 1 problems", output.getvalue())
+        self.assertFalse(ct.all_loaded)
+        self.assertEqual(ct.students["Ben O'Neil"].sheets, {})
+        # unsaved changes are checked with the scores of the file
+        ct.mutate('addboard', "Ben O'Neil", 1)
+        self.assertEqual(ct.check(), [problem])
+        ct.load_scores('1')
+        self.assertEqual(ct.check(), [problem])
+        ct.mutate('scores', "Ben O'Neil", '1', {'2': '1'})
+        self.assertEqual(ct.check(), [])
+        self.assertEqual(ct.loaded_sheets, {'1'})
+
+
+class NameIndexTest(TutorTestCase):
+
+    def test_name_used_as_id(self):
+        ct = self.tutor()
+        # the id of Anna Berg is the name of another student
+        ct.mutate('student', "1000", '')
+        ct.mutate('id', "Anna Berg", '2000')
+        self.assertIn("1000", ct.name_index.search("1000", 5))
+        self.assertIn("2000", ct.name_index.search("2000", 5))
+        ct.undo()
+        ct.undo()
+        self.assertIn("1000", ct.name_index.search("1000", 5))
+        self.assertNotIn("2000", ct.name_index.slots)
+
+
+class ScheinTest(TutorTestCase):
+
+    def test_decision(self):
+        rules = craftytutor.SCHEIN_RULES
+        for perc_written, perc_vote, board, decision in (
+                (50.0, 50.0, 1, 'yes'), (80.0, 90.0, 3, 'yes'),
+                (49.0, 60.0, 1, 'ask'), (60.0, 45.1, 1, 'ask'),
+                (45.0, 60.0, 1, 'no'), (60.0, 20.0, 5, 'no'),
+                (60.0, 60.0, 0, 'no'), (60.0, 60.0, "x", 'ask'),
+                (40.0, 60.0, "x", 'no')):
+            self.assertEqual(craftytutor.schein_decision(
+                rules, perc_written, perc_vote, board), decision,
+                (perc_written, perc_vote, board))
+
+    def test_stale(self):
+        # Anna Berg is borderline with 47.4% written points
+        ct = self.tutor(answers={'scheine.passed': 'yes'})
+        filename = ct.output_filename("scheine_{}.tex")
+        ct.print_scheine()
+        with open(filename) as fscheine:
+            self.assertIn("Anna Berg", fscheine.read())
+        self.assertEqual(ct.stale_outputs(), [])
+        # more points of a student who got none
+        ct.mutate('scores', "Ben O'Neil", '2', {'3': '5.5', '4': '3'})
+        ct.mutate('scores', "Ben O'Neil", '1', {'1': '4', '2': '4'})
+        ct.mutate('addboard', "Ben O'Neil", 1)
+        self.assertEqual(ct.stale_outputs(), [filename])
+        ct.print_scheine()
+        self.assertEqual(ct.stale_outputs(), [])
+        # changes not changing any decision
+        ct.mutate('scores', "Cem <Yilmaz>", '1', {'1': '1'})
+        self.assertEqual(ct.stale_outputs(), [])
+        # Anna Berg passes by the rules now
+        ct.answers['scheine.written'] = '45'
+        self.assertEqual(ct.stale_outputs(), [filename])
+        ct.print_scheine()
+        self.assertEqual(ct.stale_outputs(), [])
+        ct.mutate('id', "Anna Berg", '2000')
+        self.assertEqual(ct.stale_outputs(), [filename])
+
+
+class OutputFilesTest(TutorTestCase):
+
+    def test_next_to_group_file(self):
+        ct = self.tutor(answers={'scheine.passed': 'yes'})
+        ct.print_table('1')
+        ct.print_scheine()
+        self.assertEqual(sorted(name for name in os.listdir(self.dir)
+                                if name.endswith(('.tex', '.manifest'))),
+                         ['group.manifest', 'group_sheet1.tex',
+                          'scheine_group.tex'])
+
+
+class ImportScoresTest(TutorTestCase):
+
+    def import_scores(self, ct, sheet, text):
+        """Import a score file, return the number and the report."""
+        filename = os.path.join(self.dir, 'scores.csv')
+        with open(filename, 'w', newline='') as fscores:
+            fscores.write(text)
+        with contextlib.redirect_stdout(io.StringIO()) as report:
+            count = ct.importscores(sheet, filename)
+        return count, report.getvalue()
+
+    def test_rows(self):
+        ct = self.tutor()
+        count, report = self.import_scores(
+            ct, '2', "Ben O'Neil,4,2.5\n\n1000,,1\n")
+        self.assertEqual(count, 2)
+        self.assertNotIn("Skipped", report)
+        ben = ct.students["Ben O'Neil"]
+        self.assertEqual(ben.sheets['2']['3'].value, 4)
+        self.assertEqual(ben.sheets['2']['4'].value, 2.5)
+        anna = ct.students['Anna Berg']
+        self.assertEqual(anna.sheets['2']['3'].value, 1.5)
+        self.assertEqual(anna.sheets['2']['4'].value, 1)
+
+    def test_header(self):
+        ct = self.tutor()
+        count, report = self.import_scores(
+            ct, '2', "Name,A4,a3\nBen O'Neil,3,5\n")
+        self.assertEqual(count, 1)
+        ben = ct.students["Ben O'Neil"]
+        self.assertEqual(ben.sheets['2']['3'].value, 5)
+        self.assertEqual(ben.sheets['2']['4'].value, 3)
+
+    def test_misspelled_first_row(self):
+        ct = self.tutor()
+        # the scores are problem numbers of the sheet
+        count, report = self.import_scores(
+            ct, '2', "Ben ONeil,4,3\nAnna Berg,5,3\n")
+        self.assertEqual(count, 1)
+        self.assertIn("line 1: unknown student 'Ben ONeil'", report)
+        self.assertEqual(ct.students['Anna Berg'].sheets['2']['3'].value, 5)
+        self.assertNotIn('2', ct.students["Ben O'Neil"].sheets)
+        # problem names of another sheet are no header either
+        count, report = self.import_scores(ct, '2', "Name,A1,A2\n")
+        self.assertIn("line 1: unknown student 'Name'", report)
+
+
+class JournalTest(TutorTestCase):
+
+    def test_replay(self):
+        before = canonical(self.groupfile)
+        ct = self.tutor(journal=True)
+        ct.mutate('scores', 'Anna Berg', '2', {'4': '2'})
+        ct.mutate('sheet', '3', [['5', 'w', '4']])
+        ct.mutate('addboard', "Ben O'Neil", 1)
+        expected = state(ct)
+        ct.do_write(None)
+        self.assertEqual(canonical(self.groupfile), before)
+        self.assertTrue(os.path.exists(self.groupfile + ".journal"))
+        self.assertTrue(os.path.exists(self.sheetsfile + ".journal"))
+        self.assertEqual(state(self.tutor(journal=True)), expected)
+
+    def test_compact(self):
+        ct = self.tutor(journal=True)
+        ct.mutate('id', 'Cem <Yilmaz>', '1002')
+        ct.do_write(None)
+        ct.mutate('titles', "Analysis II", "Blatt")
+        ct.do_write(None)
+        expected = state(ct)
+        self.tutor(journal=True).do_compact(None)
+        self.assertFalse(os.path.exists(self.groupfile + ".journal"))
+        self.assertEqual(state(self.tutor()), expected)
+
+    def test_compact_large_journal(self):
+        ct = self.tutor(journal=True)
+        ct.mutate('board', 'Anna Berg', '7')
+        saved = craftytutor.JOURNAL_COMPACT_SIZE
+        craftytutor.JOURNAL_COMPACT_SIZE = 0
+        try:
+            ct.do_write(None)
+        finally:
+            craftytutor.JOURNAL_COMPACT_SIZE = saved
+        self.assertFalse(os.path.exists(self.groupfile + ".journal"))
+        self.assertEqual(self.tutor().students['Anna Berg'].board, 7)
+
+    def test_journal_of_other_file_version(self):
+        ct = self.tutor(journal=True)
+        ct.mutate('board', 'Anna Berg', '7')
+        ct.do_write(None)
+        with open(self.groupfile, 'a') as fgroup:
+            fgroup.write("\n")
+        self.assertEqual(self.tutor(journal=True).students['Anna Berg'].board,
+                         2)
+
+
+class UndoTest(TutorTestCase):
+
+    RECORDS = [
+        ['titles', "Analysis II", "Blatt"],
+        ['student', "Dora", '1003'],
+        ['id', "Ben O'Neil", '2001'],
+        ['board', "Ben O'Neil", '5'],
+        ['addboard', "Anna Berg", 1],
+        ['sheet', '3', [['5', 'w', '4'], ['6', 'v', '2']]],
+        ['scores', "Ben O'Neil", '2', {'3': '4'}],
+        ['scores', "Anna Berg", '1', {'2': '1'}],
+        ['unscores', "Anna Berg", '1'],
+    ]
+
+    def check_undo_redo(self, ct, record):
+        before = state(ct)
+        ct.mutate(*record)
+        after = state(ct)
+        self.assertNotEqual(after, before, record)
+        self.assertEqual(ct.undo(), record)
+        self.assertEqual(state(ct), before, record)
+        ct.redo()
+        self.assertEqual(state(ct), after, record)
+
+    def test_each_record(self):
+        ct = self.tutor()
+        for record in self.RECORDS:
+            self.check_undo_redo(ct, record)
+        self.check_undo_redo(ct, ['unstudent', "Dora"])
+        self.check_undo_redo(ct, ['unsheet', '3'])
+
+    def test_undo_saved(self):
+        ct = self.tutor()
+        for record in self.RECORDS:
+            ct.mutate(*record)
+        ct.do_write(None)
+        while ct.undo():
+            pass
+        ct.do_write(None)
+        self.assertEqual(canonical(self.groupfile),
+                         ET.canonicalize(GROUP_XML, strip_text=True))
+
+    def test_unstudent_not_last(self):
+        ct = self.tutor()
+        before = state(ct)
+        with self.assertRaises(ValueError):
+            ct.mutate('unstudent', "Anna Berg")
+        with self.assertRaises(ValueError):
+            ct.mutate('unsheet', '1')
+        self.assertEqual(state(ct), before)
+
+
+class DatabaseTest(TutorTestCase):
+
+    def test_totals(self):
+        database = os.path.join(self.dir, 'tutor.db')
+        ct = self.tutor(database=database)
+        model = self.tutor()
+        for change in ([], ['scores', "Ben O'Neil", '2', {'3': '2.5'}],
+                       ['student', "Dora", '1003'],
+                       ['sheet', '3', [['5', 'w', '4']]],
+                       ['scores', "Dora", '3', {'5': '4'}]):
+            if change:
+                ct.mutate(*change)
+                model.mutate(*change)
+                # totals of unsaved changes come from the model
+                self.assertEqual(ct.get_points_of_studs(),
+                                 model.get_points_of_studs())
+                ct.do_write(None)
+            self.assertEqual(ct.get_points_of_studs(),
+                             model.get_points_of_studs())
+            for probtype in ('w', 'v'):
+                self.assertEqual(ct.get_total_points(probtype),
+                                 model.get_total_points(probtype))
+
+    def test_export(self):
+        database = os.path.join(self.dir, 'tutor.db')
+        ct = self.tutor(database=database)
+        ct.mutate('addboard', "Ben O'Neil", 2)
+        ct.do_write(None)
+        ct.do_exportxml(None)
+        self.assertEqual(self.tutor().students["Ben O'Neil"].board, 2)
+
+    def test_duplicate_sheet(self):
+        database = os.path.join(self.dir, 'tutor.db')
+        ct = self.tutor(database=database)
+        ct.answers['newsheet.number'] = '2'
+        ct.answers['newsheet.problems'] = '5:w:4'
+        ct.do_newsheet(None)
+        self.assertNotIn('5', [prob.no for sheet in ct.sheet_list
+                               for prob in sheet.probs])
+        # a failing write keeps the changes, they can be undone
+        ct.mutate('sheet', '2', [['5', 'w', '4']])
+        ct.do_write(None)
+        self.assertEqual(len(ct.pending), 1)
+        ct.undo()
+        ct.mutate('scores', "Ben O'Neil", '2', {'3': '1'})
+        ct.do_write(None)
+        self.assertEqual(ct.pending, [])
+
+    def test_import_duplicate_sheet(self):
+        with open(self.sheetsfile, 'w', encoding='utf-8') as fsheets:
+            fsheets.write(SHEETS_XML.replace('no="2"', 'no="1"'))
+        with self.assertRaises(ValueError):
+            self.tutor(database=os.path.join(self.dir, 'tutor.db'))
+
+
+class AutosaveTest(TutorTestCase):
+
+    def crash(self):
+        """Leave a recovery file with an unsaved change like a session
+        that was killed."""
+        ct = self.tutor(autosave=0.01)
+        ct.mutate('scores', "Ben O'Neil", '2', {'3': '5'})
+        autosavefile = self.groupfile + ".autosave"
+        for i in range(500):
+            if os.path.exists(autosavefile):
+                break
+            time.sleep(0.01)
+        ct.stop_autosave()
+        self.assertTrue(os.path.exists(autosavefile))
+        return autosavefile
+
+    def test_recover(self):
+        self.crash()
+        ct = self.tutor(answers={'autosave.recover': 'yes'})
+        self.assertEqual(ct.pending, [['scores', "Ben O'Neil", '2',
+                                       {'3': '5'}]])
+        self.assertEqual(ct.students["Ben O'Neil"].sheets['2']['3'].text,
+                         '5')
+
+    def test_discard(self):
+        autosavefile = self.crash()
+        ct = self.tutor(answers={'autosave.recover': 'no'})
+        self.assertEqual(ct.pending, [])
+        self.assertFalse(os.path.exists(autosavefile))
+
+    def test_batch_keeps_recovery_file(self):
+        autosavefile = self.crash()
+        ct = self.tutor()
+        self.assertEqual(ct.pending, [])
+        self.assertTrue(os.path.exists(autosavefile))
+        self.assertEqual(len(self.tutor(answers={'autosave': 'yes'})
+                             .pending), 1)
+
+    def test_files_changed(self):
+        self.crash()
+        ct = self.tutor()
+        ct.mutate('board', "Anna Berg", '3')
+        ct.do_write(None)
+        self.assertEqual(self.tutor(answers={'autosave.recover': 'yes'})
+                         .pending, [])
+
+    def test_tables_never_recover(self):
+        autosavefile = self.crash()
+        craftytutor.init_table_worker(
+                self.sheetsfile, tutormodel.flatten_sheets(
+                    craftytutor.load_xml(self.sheetsfile, 'sheets')))
+        filenames, output = craftytutor.render_group_tables(
+                self.groupfile, ['2'], {'autosave.recover': 'yes'},
+                'csv')
+        with open(filenames[0]) as ftable:
+            rows = {row[0]: row for row in csv.reader(ftable)}
+        self.assertEqual(rows["Ben O'Neil"][rows['Name'].index('A3')], "")
+        self.assertTrue(os.path.exists(autosavefile))
+
+
+class DaemonTest(TutorTestCase):
+
+    def setUp(self):
+        TutorTestCase.setUp(self)
+        self.othergroup = os.path.join(self.dir, 'other.xml')
+        shutil.copy(self.groupfile, self.othergroup)
+        self.socket = os.path.join(self.dir, 'socket')
+        self.daemon = craftytutor.TutorDaemon(
+                self.sheetsfile, [self.groupfile, self.othergroup])
+        self.server = tutordaemon.DaemonServer(self.socket,
+                                               self.daemon.dispatch)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.daemon.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.daemon.close()
+        TutorTestCase.tearDown(self)
+
+    def client(self, group=None):
+        client = CraftyTutor(self.sheetsfile, group or self.groupfile,
+                             batch=True, daemon=self.socket)
+        self.clients.append(client)
+        return client
+
+    def test_changes_of_others(self):
+        a = self.client()
+        b = self.client()
+        c = self.client(self.othergroup)
+        a.mutate('scores', "Ben O'Neil", '2', {'3': '4'})
+        a.mutate('sheet', '3', [['5', 'w', '4']])
+        b.sync()
+        c.sync()
+        self.assertEqual(state(b), state(a))
+        self.assertIn('3', c.sheets)
+        self.assertNotIn('2', c.students["Ben O'Neil"].sheets)
+
+    def test_board_counts_add_up(self):
+        a = self.client()
+        b = self.client()
+        a.mutate('addboard', "Ben O'Neil", 1)
+        b.mutate('addboard', "Ben O'Neil", 1)
+        a.sync()
+        self.assertEqual(a.students["Ben O'Neil"].board, 2)
+        a.undo()
+        b.sync()
+        self.assertEqual(b.students["Ben O'Neil"].board, 1)
+
+    def test_undo_student_of_other(self):
+        a = self.client()
+        b = self.client()
+        a.mutate('student', "Dora", '1003')
+        b.mutate('student', "Emil", '1004')
+        a.sync()
+        self.assertIsNone(a.undo())
+        self.assertIn("Dora", a.students)
+        self.assertIsNotNone(b.undo())
+        self.assertIsNotNone(a.undo())
+        b.sync()
+        self.assertEqual(state(a), state(b))
+        self.assertEqual(b.names[-1], 'Cem <Yilmaz>')
+
+    def test_write(self):
+        a = self.client()
+        a.mutate('id', 'Cem <Yilmaz>', '1002')
+        expected = state(a)
+        a.do_write(None)
+        self.assertEqual(state(self.tutor()), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
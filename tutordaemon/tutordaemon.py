@@ -0,0 +1,85 @@
+# Unix socket server and client exchanging JSON messages, one per line
+
+import json
+import socket
+import socketserver
+import threading
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve the requests of any number of clients one at a time.
+
+    dispatch(client, request) is called with 'lock' held for every request
+    of a client and returns the response. When a client disconnects it is
+    called with request None.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, dispatch):
+        self.dispatch = dispatch
+        self.lock = threading.Lock()
+        self.clients = 0
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.clients += 1
+            client = server.clients
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {'error': "invalid request"}
+                else:
+                    with server.lock:
+                        response = server.dispatch(client, request)
+                self.wfile.write(encode(response))
+        finally:
+            with server.lock:
+                server.dispatch(client, None)
+
+
+class DaemonClient(object):
+    """Connection to a DaemonServer."""
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def request(self, op, **args):
+        """Send the request op with its arguments and return the response."""
+        args['op'] = op
+        self.file.write(encode(args))
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("the daemon closed the connection")
+        return json.loads(line)
+
+
+def is_running(path):
+    """Check whether a server listens on the socket path."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def encode(message):
+    """Return a message as one line of JSON."""
+    return json.dumps(message).encode() + b"\n"
@@ -0,0 +1,222 @@
+# In-memory model of sheets and groups, built from xml trees or a flat format
+
+import xml.etree.ElementTree as ET
+
+
+class Problem(object):
+    """A problem of a sheet.
+
+    'points' holds the parsed maximum points, None if 'text' is no number.
+    """
+
+    __slots__ = ('no', 'type', 'text', 'points')
+
+    def __init__(self, no, probtype, text):
+        self.no = no
+        self.type = probtype
+        self.text = text
+        self.points = to_number(text)
+
+
+class Sheet(object):
+    """A problem sheet with its problems in order.
+
+    'attrib' and 'extra' keep unknown xml attributes and unknown child
+    elements as xml text, see unknown_xml.
+    """
+
+    __slots__ = ('no', 'probs', 'attrib', 'extra')
+
+    def __init__(self, no, probs=None, attrib=None, extra=None):
+        self.no = no
+        self.probs = probs if probs is not None else []
+        self.attrib = attrib
+        self.extra = extra
+
+
+class Score(object):
+    """The score of a student for a problem.
+
+    'text' is the score as entered, 'value' the parsed score or None if
+    it is missing or no number.
+    """
+
+    __slots__ = ('text', 'value')
+
+    def __init__(self, text):
+        self.text = text
+        self.value = to_number(text)
+
+
+class Student(object):
+    """A student of a group.
+
+    'board' is the number of presented problems, the text if it is no
+    valid count. 'sheets' maps sheet numbers to dicts mapping problem
+    numbers to Score. Fields missing in the xml tree are None.
+    'attrib' and 'extra' are those of Sheet.
+    """
+
+    __slots__ = ('name', 'id', 'board', 'sheets', 'attrib', 'extra')
+
+    def __init__(self, name=None, studid=None, board=None, attrib=None,
+                 extra=None):
+        self.name = name
+        self.id = studid
+        self.board = board
+        self.sheets = {}
+        self.attrib = attrib
+        self.extra = extra
+
+
+class Group(object):
+    """Title, subtitle and students of a group.
+
+    'attrib' and 'extra' are those of Sheet for the root element.
+    """
+
+    __slots__ = ('title', 'subtitle', 'students', 'attrib', 'extra')
+
+    def __init__(self, title=None, subtitle=None, attrib=None, extra=None):
+        self.title = title
+        self.subtitle = subtitle
+        self.students = []
+        self.attrib = attrib
+        self.extra = extra
+
+
+########################################################################
+# Conversion from xml trees                                            #
+########################################################################
+
+def sheets_from_xml(root):
+    """Return the list of sheets of the xml tree of a sheets file."""
+    sheets = []
+    for xsheet in root.iterfind('sheet'):
+        sheet = Sheet(xsheet.get('no'), [
+            Problem(xprob.get('no'), xprob.get('type'), xprob.text)
+            for xprob in xsheet.iterfind('prob')])
+        sheet.attrib, sheet.extra = unknown_xml(xsheet, ('no',), ('prob',))
+        sheets.append(sheet)
+    return sheets
+
+
+def group_from_xml(root):
+    """Return the group of the xml tree of a group file."""
+    group = Group()
+    for child in root:
+        if child.tag == 'student':
+            group.students.append(student_from_xml(child))
+        elif child.tag == 'title':
+            group.title = child.text or ""
+        elif child.tag == 'subtitle':
+            group.subtitle = child.text or ""
+    group.attrib, group.extra = unknown_xml(
+            root, (), ('student', 'title', 'subtitle'))
+    return group
+
+
+def student_from_xml(xstud, sheet_nos=None):
+    """Return the student of the xml tree of a student.
+
+    @sheet_nos: only read the scores of these sheets, None for all
+    """
+    stud = Student()
+    for child in xstud:
+        tag = child.tag
+        if tag == 'sheet':
+            sheet_no = child.get('no')
+            if sheet_nos is not None and sheet_no not in sheet_nos:
+                continue
+            scores = stud.sheets.setdefault(sheet_no, {})
+            for xprob in child:
+                scores[xprob.get('no')] = Score(xprob.text)
+        elif tag == 'name':
+            stud.name = child.text or ""
+        elif tag == 'id':
+            stud.id = child.text or ""
+        elif tag == 'board':
+            board = child.text or ""
+            stud.board = int(board) if board.isdigit() else board
+    stud.attrib, stud.extra = unknown_xml(
+            xstud, (), ('sheet', 'name', 'id', 'board'))
+    return stud
+
+
+def unknown_xml(elem, attribs, tags):
+    """Return the attributes of a xml element not in attribs and the
+    xml text of its children whose tag is not in tags.
+
+    Both are None if there are none, so they cost no memory.
+    """
+    attrib = {key: value for key, value in elem.attrib.items()
+              if key not in attribs} or None
+    extra = [xml_text(child) for child in elem if child.tag not in tags]
+    return attrib, extra or None
+
+
+def xml_text(elem):
+    """Return a xml element as text without its tail."""
+    elem.tail = None
+    return ET.tostring(elem, encoding='unicode')
+
+
+########################################################################
+# Flat format of plain lists for snapshots                             #
+########################################################################
+
+def flatten_sheets(sheets):
+    """Return the sheets as nested lists of strings."""
+    return [[sheet.no, [[prob.no, prob.type, prob.text]
+                        for prob in sheet.probs], sheet.attrib, sheet.extra]
+            for sheet in sheets]
+
+
+def unflatten_sheets(flat):
+    """Rebuild the sheets flattened by flatten_sheets."""
+    return [Sheet(no, [Problem(*prob) for prob in probs], attrib, extra)
+            for no, probs, attrib, extra in flat]
+
+
+def flatten_group(group):
+    """Return the group as nested lists of strings and numbers.
+
+    The scores of a student are flattened to [sheet number, [problem
+    number, score, problem number, score, ...], sheet number, ...].
+    """
+    students = []
+    for stud in group.students:
+        sheets = []
+        for sheet_no, scores in stud.sheets.items():
+            probs = []
+            for prob_no, score in scores.items():
+                probs.append(prob_no)
+                probs.append(score.text)
+            sheets.append(sheet_no)
+            sheets.append(probs)
+        students.append([stud.name, stud.id, stud.board, sheets,
+                         stud.attrib, stud.extra])
+    return [group.title, group.subtitle, students, group.attrib, group.extra]
+
+
+def unflatten_group(flat):
+    """Rebuild the group flattened by flatten_group."""
+    title, subtitle, students, attrib, extra = flat
+    group = Group(title, subtitle, attrib, extra)
+    for name, studid, board, sheets, attrib, extra in students:
+        stud = Student(name, studid, board, attrib, extra)
+        items = iter(sheets)
+        for sheet_no, probs in zip(items, items):
+            # pairs of problem number and score taken from one iterator
+            probs = iter(probs)
+            stud.sheets[sheet_no] = dict(zip(probs, map(Score, probs)))
+        group.students.append(stud)
+    return group
+
+
+def to_number(text):
+    """Return text as float or None if it is no number."""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None